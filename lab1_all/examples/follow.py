@@ -1,9 +1,13 @@
 import picar_4wd as fc
 
 speed = 30
+# one scan step and steering decision per tick. scan_step waits 40ms for the servo
+# and the echo can take another 30ms, so 10Hz leaves headroom where 20Hz would miss
+loop = fc.RateLoop(10, "follow")
 
 def main():
     while True:
+        loop.sleep()
         scan_list = fc.scan_step(23)
         # print(scan_list)
         if not scan_list:
@@ -40,3 +44,4 @@ if __name__ == "__main__":
         main()
     finally:
         fc.stop()
+        print(loop.stats())
@@ -47,7 +47,7 @@ Manual.show = function () {
     document.querySelector('#header').style.display = 'block';
     document.querySelector('.menu').style.display = 'block';
     // Manual.setUltrasonic();
-    requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+    requireWebsocket.send(Manual.sendValue);
 }
 
 Manual.hide = function () {
@@ -69,7 +69,7 @@ Manual.hide = function () {
         'US':['off',0],  // 超声波设置
         'MS':['off',1,0] // 测速设置
     }
-    requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+    requireWebsocket.send(Manual.sendValue);
     $('.ultrasonic_dot_block').html('');
 }
 
@@ -92,7 +92,7 @@ Manual.setRange = function () {
         console.log(e.value);
         $('.power>span').html(`${e.value}%`)
         Manual.sendValue['PW'] = e.value;
-        requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+        requireWebsocket.send(Manual.sendValue)
     }
     $('input#power_slider_input').RangeSlider({min: 0, max: 100, step: 1, callback:change})
 }
@@ -113,7 +113,7 @@ Manual.setSpeedScale = function (data) {
 
 Manual.setUltrasonic = function (data) {
     Manual.sendValue['US'] = 'on';
-    requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+    requireWebsocket.send(Manual.sendValue)
 }
 
 Manual.setUltrasonicSean = function (data) {
@@ -144,7 +144,7 @@ Manual.setUltrasonicSean = function (data) {
 
 // Manual.closeUltrasonic = function () {
 //     Manual.sendValue['ob'] = 'off';
-//     requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+//     requireWebsocket.send(Manual.sendValue)
 // }
 
 Manual.upArrowEvent = function () {
@@ -154,13 +154,13 @@ Manual.upArrowEvent = function () {
             e.preventDefault();
             Manual.sendValue['RC'] = 'forward'
             timeout = setInterval(function(){
-                requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+                requireWebsocket.send(Manual.sendValue)
             }, 30)
         },
         "touchend": function () {
             clearInterval(timeout);
             Manual.sendValue['RC'] = 'rest'
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
     })
 }
@@ -172,13 +172,13 @@ Manual.downArrowEvent = function () {
             e.preventDefault();
             Manual.sendValue['RC'] = 'backward'
             timeout = setInterval(function(){
-                requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+                requireWebsocket.send(Manual.sendValue)
             }, 30)
         },
         "touchend": function () {
             clearInterval(timeout);
             Manual.sendValue['RC'] = 'rest'
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
     })
 }
@@ -190,13 +190,13 @@ Manual.leftArrowEvent = function () {
             e.preventDefault();
             Manual.sendValue['RC'] = 'turn_left'
             timeout = setInterval(function(){
-                requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+                requireWebsocket.send(Manual.sendValue)
             }, 30)
         },
         "touchend": function () {
             clearInterval(timeout);
             Manual.sendValue['RC'] = 'rest'
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
     })
 }
@@ -208,13 +208,13 @@ Manual.rightArrowEvent = function () {
             e.preventDefault();
             Manual.sendValue['RC'] = 'turn_right'
             timeout = setInterval(function(){
-                requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+                requireWebsocket.send(Manual.sendValue)
             }, 30)
         },
         "touchend": function () {
             clearInterval(timeout);
             Manual.sendValue['RC'] = 'rest'
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
     })
 }
@@ -242,13 +242,13 @@ Manual.menuItemClick = function (reset) {
             $(this).css({'opacity': 1})
             $('.menu_item_follow').css({'opacity': 0.5})
             flag_ultrasonic = false;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }else {
             Manual.ultrasonicFlag = 'off';
             Manual.sendValue['RD'] = Manual.ultrasonicFlag;
             $(this).css({'opacity': 0.5})
             flag_ultrasonic = true;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
         
     })
@@ -260,13 +260,13 @@ Manual.menuItemClick = function (reset) {
             $(this).css({'opacity': 1})
             $('.menu_item_follow').css({'opacity': 0.5})
             flag_grayScale = false;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }else {
             Manual.grayscaleFlag = 'off';
             Manual.sendValue['GS'] = Manual.grayscaleFlag;
             $(this).css({'opacity': 0.5})
             flag_grayScale = true;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
         
     })
@@ -280,7 +280,7 @@ Manual.menuItemClick = function (reset) {
             $('.menu_item_follow').css({'opacity': 0.5})
             flag_aviod = false;
             flag_follow = true;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }else {
             Manual.aviodFlag = 'off'
             Manual.followFlag = 'off'
@@ -289,7 +289,7 @@ Manual.menuItemClick = function (reset) {
             $(this).css({'opacity': 0.5})
             flag_aviod = true;
             flag_follow = true;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
         
     })
@@ -304,7 +304,7 @@ Manual.menuItemClick = function (reset) {
             $(this).css({'opacity': 1})
             flag_follow = false;
             flag_aviod = true;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }else {
             Manual.aviodFlag = 'off'
             Manual.followFlag = 'off'
@@ -313,7 +313,7 @@ Manual.menuItemClick = function (reset) {
             $(this).css({'opacity': 0.5})
             flag_follow = true;
             flag_aviod = true;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
     })
     $('.menu_item_cliff').click(function() {
@@ -323,14 +323,14 @@ Manual.menuItemClick = function (reset) {
             Manual.sendValue['GS'] = 'on';
             $(this).css({'opacity': 1})
             flag_cliff = false;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }else {
             Manual.cliffFlag = 'off';
             Manual.sendValue['CD'] = ['off', Setting.grayscale.cliffReference]
             Manual.sendValue['GS'] = Manual.grayscaleFlag;
             $(this).css({'opacity': 0.5})
             flag_cliff = true;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
     })
     $('.menu_item_path').click(function() {
@@ -339,13 +339,13 @@ Manual.menuItemClick = function (reset) {
             Manual.sendValue['GS'] = 'on';
             $(this).css({'opacity': 1})
             flag_path = false;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }else {
             Manual.sendValue['TL'] = ['off', Setting.grayscale.lineReference]
             Manual.sendValue['GS'] = Manual.grayscaleFlag;
             $(this).css({'opacity': 0.5})
             flag_path = true;
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
     })
     $('.menu_item_setting').click(function() {
@@ -376,7 +376,8 @@ Manual.mileage = function (data) {
     var speedFirst = parseFloat(Manual.mileageObj['first'][0]);
     var speedLast = parseFloat(Manual.mileageObj['last'][0]);
     if (Manual.mileageObj['first'] != undefined) {
-        Manual.mileageValue += ((speedFirst + speedLast) / 2) * (timeLast - timeFirst)
+        // speed is only sent when it changes, so it held speedFirst until timeLast
+        Manual.mileageValue += speedFirst * (timeLast - timeFirst)
         $('.mileage>span').html(`${Math.round(Manual.mileageValue)}cm`)
     }
 }
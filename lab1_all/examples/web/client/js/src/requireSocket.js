@@ -1,17 +1,29 @@
 var requireWebsocket = {};
 
+// sequence number of the last command, the server drops anything older
+requireWebsocket.seq = 0;
+// last measured time from sending a command to the motors applying it (ms)
+requireWebsocket.lag = 0;
+
 requireWebsocket.connect = function () {
-    // requireWebsocket.reqWs = new WebSocket(`ws://192.168.18.185:8766`);
+    // requireWebsocket.reqWs = new WebSocket(`ws://192.168.18.185:8765`);
 
+    // one socket carries the commands, their acks and the telemetry
     requireWebsocket.reqWs = new WebSocket(`ws://${window.location.hostname}:8765`);
 
     requireWebsocket.reqWs.onopen = function () {
-        console.log("require socket connect open...");
-        requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+        console.log("socket connect open...");
+        requireWebsocket.send(Manual.sendValue);
     }
     
     requireWebsocket.reqWs.onmessage = function (event) {
-        console.log(event);
+        var message = JSON.parse(event["data"]);
+        if (message['type'] == 'telemetry') {
+            responseWebsocket.onTelemetry(message['data']);
+        } else if (message['type'] == 'ack') {
+            requireWebsocket.lag = Date.now() - message['ts'];
+            console.log(`control lag: ${requireWebsocket.lag}ms (server ${message['apply_ms']}ms, ${message['coalesced']} stale commands dropped)`);
+        }
     }
     // reqWs.send({"mode": 1,"rc": 'forward', 'ob': 3, "fl": 4, "f": 5, 'ed': 6})
     
@@ -26,4 +38,12 @@ requireWebsocket.connect = function () {
     }    
 }
 
-
+requireWebsocket.send = function (value) {
+    requireWebsocket.seq += 1;
+    requireWebsocket.reqWs.send(JSON.stringify({
+        'type': 'control',
+        'seq': requireWebsocket.seq,
+        'ts': Date.now(),
+        'data': value
+    }));
+}
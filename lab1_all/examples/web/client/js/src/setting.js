@@ -36,7 +36,7 @@ Setting.show = function () {
         Manual.sendValue['US'] = ['on', 0];
     }
    
-    requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+    requireWebsocket.send(Manual.sendValue);
 }
 
 Setting.hide = function () {
@@ -49,7 +49,7 @@ Setting.hide = function () {
     Manual.sendValue['ST'] = 'off';
     Manual.sendValue['TL'] = ['off', Setting.grayscale.lineReference];
     Manual.sendValue['CD'] = ['off', Setting.grayscale.cliffReference];
-    requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+    requireWebsocket.send(Manual.sendValue);
 }
 
 Setting.init = function() {
@@ -80,36 +80,36 @@ Setting.tabClick = function () {
         $('.setting_block').eq($(this).index()).show();
         if ($(this).index() === 0) {
             Manual.sendValue['US'] = ['on', 0];
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+            requireWebsocket.send(Manual.sendValue);
         } else{
             Setting.ultrasonic.show = false;
             Manual.sendValue['US'] = ['off', 0];
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+            requireWebsocket.send(Manual.sendValue);
         }
         if ($(this).index() === 1) {
             Manual.sendValue['MS'] = ['on', 2, 0];
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+            requireWebsocket.send(Manual.sendValue);
         }else {
             Manual.sendValue['MS'] = ['off', 2, 0];
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+            requireWebsocket.send(Manual.sendValue);
         }
         if ($(this).index() === 2) {
             Setting.grayscale.show = true;
             Manual.sendValue['GS'] = 'on';
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+            requireWebsocket.send(Manual.sendValue);
         }else {
             Setting.grayscale.show = false;
             Manual.sendValue['GS'] = 'off';
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+            requireWebsocket.send(Manual.sendValue);
         }
         if ($(this).index() === 3) {
             Setting.system.showFlag = true;
             Manual.sendValue['ST'] = 'on';
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+            requireWebsocket.send(Manual.sendValue);
         }else {
             Setting.system.showFlag = false;
             Manual.sendValue['ST'] = 'off';
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue));
+            requireWebsocket.send(Manual.sendValue);
         }
     })
 }
@@ -118,7 +118,7 @@ Setting.ultrasonic.rangeSet = function () {
     var change = function (e) {
         Manual.sendValue['US'][0] = 'on';
         Manual.sendValue['US'][1] = e.value;
-        requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+        requireWebsocket.send(Manual.sendValue)
     }
     $('input#setting_ultrasonic_slider_range').RangeSlider({min: -90, max: 90, step: 1, callback:change})
 }
@@ -216,13 +216,13 @@ Setting.wheel.upArrowEvent = function () {
             e.preventDefault();
             Manual.sendValue['MS'] = ['on', Setting.wheel.motor, Setting.wheel.speedValueText]
             timeout = setInterval(function(){
-                requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+                requireWebsocket.send(Manual.sendValue)
             }, 30)
         },
         "touchend": function () {
             clearInterval(timeout);
             Manual.sendValue['MS'] = ['on', Setting.wheel.motor, 0]
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
     })
 }
@@ -234,13 +234,13 @@ Setting.wheel.downArrowEvent = function () {
             e.preventDefault();
             Manual.sendValue['MS'] = ['on', Setting.wheel.motor, -Setting.wheel.speedValueText]
             timeout = setInterval(function(){
-                requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+                requireWebsocket.send(Manual.sendValue)
             }, 30)
         },
         "touchend": function () {
             clearInterval(timeout);
             Manual.sendValue['MS'] = ['on', Setting.wheel.motor, 0]
-            requireWebsocket.reqWs.send(JSON.stringify(Manual.sendValue))
+            requireWebsocket.send(Manual.sendValue)
         }
     })
 }
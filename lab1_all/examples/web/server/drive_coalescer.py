@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+
+class DriveCoalescer(object):
+    """Latest-value-wins slot between the websocket and the motors.
+
+    submit() only records that new drive state arrived. run() applies the
+    most recent state when the hardware is free, so joystick packets that
+    queue up while the motors are busy are dropped rather than replayed in
+    order. Every applied command is acknowledged through its reply
+    callback with how long it waited and how many commands it replaced.
+
+    If applying fails the error is logged, the car is stopped through
+    stop() when given, and the loop keeps serving later commands.
+    """
+
+    def __init__(self, apply, stop=None):
+        self.apply = apply # coroutine function, applies the current drive state
+        self.stop = stop # coroutine function, called when apply() fails
+        self.errors = 0
+        self._pending = None
+        self._event = None
+        self.received = 0
+        self.dropped = 0
+        self.apply_ms = 0
+
+    def submit(self, seq=None, ts=None, reply=None):
+        if self._event is None:
+            self._event = asyncio.Event()
+        self.received += 1
+        if self._pending is not None:
+            self.dropped += 1
+            coalesced = self._pending[4] + 1
+        else:
+            coalesced = 0
+        self._pending = (seq, ts, reply, time.monotonic(), coalesced)
+        self._event.set()
+
+    async def run(self):
+        if self._event is None:
+            self._event = asyncio.Event()
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            seq, ts, reply, received_at, coalesced = self._pending
+            self._pending = None
+            try:
+                await self.apply()
+            except Exception as e:
+                self.errors += 1
+                print("drive failed: %s" % e)
+                if self.stop is not None:
+                    try:
+                        await self.stop()
+                    except Exception as e:
+                        print("stop after failed drive failed: %s" % e)
+                continue
+            self.apply_ms = round((time.monotonic() - received_at) * 1000, 1)
+            if reply is not None:
+                try:
+                    await reply(seq, ts, self.apply_ms, coalesced)
+                except Exception as e:
+                    # the client went away, the command was still applied
+                    print("ack failed: %s" % e)
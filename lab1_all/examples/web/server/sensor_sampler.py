@@ -0,0 +1,50 @@
+import threading
+import time
+import picar_4wd as fc
+
+
+class SensorSampler(object):
+    """Read grayscale, ultrasonic and speed on a background thread.
+
+    The websocket coroutines read the cached values instead of touching the
+    hardware inline. Hardware access goes through fc.hw_call so it is
+    serialised with the async control loop, and the servo settles between
+    calls so drive commands never wait behind the sleep.
+    """
+
+    def __init__(self, period=0.02):
+        self.period = period
+        self.grayscale = [0, 0, 0]
+        self.ultrasonic = [0, 0]
+        self.speed = 0
+        # angle to keep measuring at, None follows fc.angle_distance
+        self.ultrasonic_angle = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="SensorSampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            self.grayscale = fc.hw_call(fc.get_grayscale_list)
+            angle = self.ultrasonic_angle
+            if angle is not None:
+                fc.hw_call(fc.servo.set_angle, angle)
+                time.sleep(0.04)
+                self.ultrasonic = [angle, fc.hw_call(fc.us.get_distance)]
+            else:
+                self.ultrasonic = list(fc.angle_distance)
+            self.speed = fc.speed_val()
+            next_time += self.period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_time = time.monotonic()
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlparse, parse_qs
+
+# Binary encodings are optional, the browser client only speaks JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+def get_encoder(name):
+    """Return (encode function, resolved name) for json/msgpack/cbor."""
+    if name == 'msgpack' and msgpack is not None:
+        return msgpack.packb, 'msgpack'
+    if name == 'cbor' and cbor2 is not None:
+        return cbor2.dumps, 'cbor'
+    if name not in (None, 'json'):
+        print("Encoding %s is not available, falling back to json" % name)
+    return json.dumps, 'json'
+
+
+def encoding_from_path(path):
+    """Read the opt-in encoding from a websocket path like /?enc=msgpack"""
+    query = parse_qs(urlparse(path or '').query)
+    return query.get('enc', ['json'])[0]
+
+
+class TelemetryPublisher(object):
+    """Push telemetry to one websocket, sending only the fields that changed.
+
+    The first frame and every keyframe_interval seconds carry the full
+    state so a client that missed something can resync. The push interval
+    adapts to backpressure: it doubles when a send has to wait for the
+    socket to drain and slowly shrinks back to min_interval otherwise.
+    change_keys maps a field to a function returning the part of its value
+    that counts as a change, e.g. the speed of MS but not its timestamp.
+    With message_type set, frames are wrapped as {"type": ..., "data": delta}
+    so they can share a socket with other messages.
+    """
+
+    def __init__(self, websocket, encoding='json', min_interval=0.01, max_interval=0.5,
+                 keyframe_interval=2.0, change_keys=None, message_type=None):
+        self.websocket = websocket
+        self.encode, self.encoding = get_encoder(encoding)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.keyframe_interval = keyframe_interval
+        self.change_keys = change_keys or {}
+        self.message_type = message_type
+        self._last = {}
+        self._last_keyframe = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def _key(self, name, value):
+        key = self.change_keys.get(name)
+        return key(value) if key is not None else value
+
+    def diff(self, state, now=None):
+        """Return the fields of state that changed since the last publish."""
+        now = time.monotonic() if now is None else now
+        if now - self._last_keyframe >= self.keyframe_interval:
+            self._last_keyframe = now
+            delta = dict(state)
+        else:
+            delta = {}
+            for name, value in state.items():
+                if name not in self._last or self._last[name] != self._key(name, value):
+                    delta[name] = value
+        for name, value in delta.items():
+            self._last[name] = self._key(name, value)
+        return delta
+
+    async def publish(self, state):
+        delta = self.diff(state)
+        if not delta:
+            return 0
+        if self.message_type is not None:
+            delta = {'type': self.message_type, 'data': delta}
+        message = self.encode(delta)
+        start = time.monotonic()
+        await self.websocket.send(message)
+        self._adapt(time.monotonic() - start)
+        self.frames_sent += 1
+        self.bytes_sent += len(message)
+        return len(message)
+
+    def _adapt(self, send_time):
+        transport = getattr(self.websocket, 'transport', None)
+        buffered = transport.get_write_buffer_size() if transport is not None else 0
+        if buffered > 0 or send_time > self.interval / 2:
+            self.interval = min(self.interval * 2, self.max_interval)
+        else:
+            self.interval = max(self.interval * 0.9, self.min_interval)
+
+    async def run(self, get_state):
+        """Publish get_state() until the websocket closes."""
+        while True:
+            await self.publish(get_state())
+            await asyncio.sleep(self.interval)
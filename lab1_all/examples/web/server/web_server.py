@@ -2,6 +2,9 @@ import picar_4wd as fc
 from picar_4wd.utils import pi_read
 from remote_control import Remote_control
 from picar_4wd import getIP
+from sensor_sampler import SensorSampler
+from telemetry_publisher import TelemetryPublisher, encoding_from_path
+from drive_coalescer import DriveCoalescer
 
 import asyncio
 import websockets
@@ -11,6 +14,7 @@ import time
 fc.start_speed_thread()
 speed_count = 0
 gs_list = []
+sampler = SensorSampler().start()
 
 
 recv_dict = {
@@ -37,74 +41,84 @@ send_dict = {
   
 
 
-async def recv_server_func(websocket):
-    global recv_dict,send_dict
-    while 1:
-        tmp = await websocket.recv()
-        tmp = json.loads(tmp)
-        for key in tmp:
-            recv_dict[key] = tmp[key]
-        recv_dict['PW'] = int(recv_dict['PW'])
-        Remote_control(recv_dict['RC'],recv_dict['PW'])
-        # print(recv_dict)
-        if  recv_dict['MS'][0] =='on':
-            fc.set_motor_power(int(recv_dict['MS'][1]), int(recv_dict['MS'][2]))
-        if  recv_dict['SR'] =='on':
-            fc.soft_reset()
-
-
-
-
-async def send_server_func(websocket): 
-    global send_dict, recv_dict, gs_list 
-    while 1:
-        send_dict ={}
-        send_dict['MS'] = [round(fc.speed_val()/2.0),time.time()] 
-        
-
-        if recv_dict['ST'] == 'on': 
-            send_dict['ST'] = pi_read() 
+# Keys that only change how the car is driven, everything else is a mode
+# switch that main_func picks up on its next pass
+DRIVE_KEYS = ('RC', 'PW', 'MS', 'SR')
+
+async def apply_drive():
+    await fc.async_call(Remote_control, recv_dict['RC'], recv_dict['PW'])
+    # print(recv_dict)
+    if  recv_dict['MS'][0] =='on':
+        await fc.async_set_motor_power(int(recv_dict['MS'][1]), int(recv_dict['MS'][2]))
+    if  recv_dict['SR'] =='on':
+        await fc.async_soft_reset()
+
+drive = DriveCoalescer(apply_drive, stop=fc.async_stop)
+
+def handle_control(tmp, seq=None, ts=None, reply=None):
+    global recv_dict
+    drive_changed = False
+    for key in tmp:
+        if key in DRIVE_KEYS:
+            drive_changed = True
+        recv_dict[key] = tmp[key]
+    recv_dict['PW'] = int(recv_dict['PW'])
+    if drive_changed:
+        drive.submit(seq, ts, reply)
+
+
+def telemetry_state():
+    state = {}
+    state['MS'] = [round(sampler.speed/2.0),time.time()] 
+
+    if recv_dict['ST'] == 'on': 
+        state['ST'] = pi_read() 
+
+    # the scanning modes move the servo themselves and update fc.angle_distance
+    scanning = 'on' in (recv_dict['OA'], recv_dict['OF'], recv_dict['RD'])
+    if  recv_dict['US'][0] =='on' and not scanning:
+        sampler.ultrasonic_angle = int(recv_dict['US'][1])
+    else:
+        sampler.ultrasonic_angle = None
+    state['US'] = sampler.ultrasonic
+    
+    if  recv_dict['GS'] =='on': 
+        state['GS'] = sampler.grayscale
 
-        if  recv_dict['US'][0] =='on':
-            send_dict['US'] = [int(recv_dict['US'][1]),fc.get_distance_at(int(recv_dict['US'][1]))]
-        else:
-            send_dict['US'] = fc.angle_distance
-        
-        if  recv_dict['GS'] =='on': 
-            send_dict['GS'] = gs_list
-        await websocket.send(json.dumps(send_dict))
-        await asyncio.sleep(0.01)
+    # time from receiving a drive command to the motors applying it
+    state['LAG'] = {'apply_ms': drive.apply_ms, 'dropped': drive.dropped}
+    return state
         
 async def main_func():
     global recv_dict,send_dict,gs_list
     while 1:
-        gs_list = fc.get_grayscale_list()
+        gs_list = sampler.grayscale
         
         if recv_dict['CD'][0] == 'on':
             if fc.is_on_edge(recv_dict['CD'][1],gs_list):
-                fc.backward(20)
-                time.sleep(0.5)
-                fc.stop()
+                await fc.async_backward(20)
+                await asyncio.sleep(0.5)
+                await fc.async_stop()
 
         if recv_dict['TL'][0] =='on':
             if fc.get_line_status(recv_dict['TL'][1],gs_list) == 0:
-                fc.forward(recv_dict['PW'])      
+                await fc.async_forward(recv_dict['PW'])      
             elif fc.get_line_status(recv_dict['TL'][1],gs_list) == -1:
-                fc.turn_left(recv_dict['PW'])
+                await fc.async_turn_left(recv_dict['PW'])
             elif fc.get_line_status(recv_dict['TL'][1],gs_list) == 1:
-                fc.turn_right(recv_dict['PW']) 
+                await fc.async_turn_right(recv_dict['PW']) 
 
         if recv_dict['OA'] == 'on':
-            scan_list = fc.scan_step(35)
+            scan_list = await fc.async_scan_step(35)
             if scan_list:
                 tmp = scan_list[3:7]
                 if tmp != [2,2,2,2]:
-                    fc.turn_right(recv_dict['PW'])
+                    await fc.async_turn_right(recv_dict['PW'])
                 else:
-                    fc.forward(recv_dict['PW'])
+                    await fc.async_forward(recv_dict['PW'])
 
         elif recv_dict['OF'] == 'on':
-            scan_list = fc.scan_step(23)
+            scan_list = await fc.async_scan_step(23)
             
             if scan_list != False:
                 scan_list = [str(i) for i in scan_list]
@@ -114,34 +128,64 @@ async def main_func():
                 for path in paths:
                     length_list.append(len(path))
                 if max(length_list) == 0:
-                    fc.stop() 
+                    await fc.async_stop() 
                 else:
                     i = length_list.index(max(length_list))
                     pos = scan_list.index(paths[i])
                     pos += (len(paths[i]) - 1) / 2
                     delta = len(scan_list) / 3
                     if pos < delta:
-                        fc.turn_left(recv_dict['PW'])
+                        await fc.async_turn_left(recv_dict['PW'])
                     elif pos > 2 * delta:
-                        fc.turn_right(recv_dict['PW'])
+                        await fc.async_turn_right(recv_dict['PW'])
                     else:
                         if scan_list[int(len(scan_list)/2-1)] == "0":
-                            fc.backward(recv_dict['PW'])
+                            await fc.async_backward(recv_dict['PW'])
                         else:
-                            fc.forward(recv_dict['PW'])
+                            await fc.async_forward(recv_dict['PW'])
     
         elif  recv_dict['RD'] == 'on':
-            fc.scan_step(35)
+            await fc.async_scan_step(35)
       
         await asyncio.sleep(0.01)
         
-async def main_logic_1(websocket,path):
-    while 1:
-        await recv_server_func(websocket)
-
-async def main_logic_2(websocket,path):
-    while 1:
-        await send_server_func(websocket)
+async def main_logic(websocket,path):
+    # One socket carries both directions:
+    #   client -> server {"type": "control", "seq": n, "ts": ms, "data": {...}}
+    #                    anything else is ignored
+    #   server -> client {"type": "telemetry", "data": {changed fields}}
+    #                    {"type": "ack", "seq": n, "ts": ms, "apply_ms": x, "coalesced": k}
+    # The client works out the end-to-end lag from the echoed ts.
+    # MS only counts as changed when the speed does, not its timestamp
+    publisher = TelemetryPublisher(websocket, encoding=encoding_from_path(path),
+                                   change_keys={'MS': lambda ms: ms[0]},
+                                   message_type='telemetry')
+    last_seq = 0
+
+    async def ack(seq, ts, apply_ms, coalesced):
+        await websocket.send(publisher.encode({'type': 'ack', 'seq': seq, 'ts': ts,
+                                               'apply_ms': apply_ms, 'coalesced': coalesced}))
+
+    send_task = asyncio.ensure_future(publisher.run(telemetry_state))
+    try:
+        async for tmp in websocket:
+            try:
+                tmp = json.loads(tmp)
+            except ValueError:
+                continue
+            # valid JSON can still be a number, string or list
+            if not isinstance(tmp, dict) or tmp.get('type') != 'control' or not isinstance(tmp.get('data'), dict):
+                continue
+            seq = tmp.get('seq')
+            # drop packets that arrive after a newer one
+            if seq is not None:
+                if seq <= last_seq:
+                    drive.dropped += 1
+                    continue
+                last_seq = seq
+            handle_control(tmp['data'], seq, tmp.get('ts'), ack)
+    finally:
+        send_task.cancel()
 
 try:
     for _ in range(10):
@@ -151,10 +195,9 @@ try:
             # start_http_server()
             break
         time.sleep(1)
-    start_server_1 = websockets.serve(main_logic_1, ip, 8765)
-    start_server_2 = websockets.serve(main_logic_2, ip, 8766)
+    start_server = websockets.serve(main_logic, ip, 8765)
     print('Start!')
-    tasks = [main_func(),start_server_1,start_server_2]
+    tasks = [main_func(),drive.run(),start_server]
     asyncio.get_event_loop().run_until_complete(asyncio.wait(tasks))
     asyncio.get_event_loop().run_forever()
  
@@ -4,7 +4,7 @@ import time
 import random
 
 class NaiveSD(object):
-	def __init__(self, angle_range: int = 120, us_step: int = 20, speed: int = 10) -> None:
+	def __init__(self, angle_range: int = 120, us_step: int = 20, speed: int = 10, control_hz: int = 20) -> None:
 		self.distance_to_obj = -2
 		self.current_angle = 0
 		self.angle_range = angle_range
@@ -12,6 +12,7 @@ class NaiveSD(object):
 		self.min_angle = self.angle_range/2*-1
 		self.us_step = us_step
 		self.speed = speed
+		self.control_hz = control_hz
 		self.logger = logging.getLogger()
 		logging.basicConfig(format='%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
     			datefmt='%Y-%m-%d:%H:%M:%S',
@@ -42,7 +43,6 @@ class NaiveSD(object):
 		fc.servo.set_angle(self.current_angle)
 		self.distance_to_obj = self.get_distance()
 		self.logger.info(f"Set distance to object at {self.distance_to_obj}cm for angle {self.current_angle}")
-		time.sleep(0.04)
 		
 		return None
 	
@@ -75,8 +75,10 @@ class NaiveSD(object):
 
 	def drive(self) -> None:
 		"""
-		Primary drive function.
+		Primary drive function. Runs one scan step per tick of a fixed-rate loop, which also
+		gives the servo time to settle between steps.
 		"""
+		loop = fc.RateLoop(self.control_hz, "drive")
 		while True:
 			fc.forward(self.speed)
 			self.scan_step_nsd()
@@ -85,6 +87,9 @@ class NaiveSD(object):
 				self.avoid_object()
 				self.new_direction()
 				fc.forward(self.speed)
+				# the maneuver blocks on purpose, don't count it as a missed deadline
+				loop.resync()
+			loop.sleep()
 
 if __name__ == "__main__":
 	try:
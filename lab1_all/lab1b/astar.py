@@ -3,6 +3,13 @@ from helper_classes import Coordinate
 import heapq
 import numpy as np
 import math
+try:
+    from picar_4wd import trace
+    traced = trace.traced
+except ImportError:
+    # planning also runs off the car (see astar_test.py) without the picar_4wd stack
+    def traced(name=None):
+        return lambda func: func
 
 def heuristic(coord1, coord2):
     # calculate the Euclidean distance as the heuristic
@@ -10,7 +17,12 @@ def heuristic(coord1, coord2):
     # manhattan_dist = abs(coord1.x - coord2.x) + abs(coord1.y - coord2.y)
     # return manhattan_dist
 
-def astar(array, start, end):
+@traced("astar")
+def astar(array, start, end, costs=None):
+    # costs is an optional InflationLayer, its blocked cells are avoided and
+    # every step costs what it charges for the cell stepped into
+    if costs is not None:
+        costs.update()
 
     # initialize the heap for the open list and the closed list
     heap = []
@@ -44,8 +56,10 @@ def astar(array, start, end):
                 array[neighbor.x][neighbor.y] == 1 or
                 neighbor in closed_list):
                 continue
+            if costs is not None and costs.is_blocked(neighbor.x, neighbor.y):
+                continue
 
-            g = g_values[current] + 1
+            g = g_values[current] + (1 if costs is None else costs.cost(neighbor.x, neighbor.y))
             f = g + heuristic(neighbor, end)
 
             if neighbor in g_values and g >= g_values[neighbor]:
@@ -13,7 +13,9 @@
 # limitations under the License.
 """Main script to run the object detection routine."""
 import argparse
+import collections
 import sys
+import threading
 import time
 
 import cv2
@@ -21,116 +23,343 @@ from tflite_support.task import core
 from tflite_support.task import processor
 from tflite_support.task import vision
 import utils
+from image_logger import ImageLogger
+from preprocess import Preprocessor
 
+# Categories the navigation reacts to
+LABELS = ('stopsign', 'redlight', 'yellowlight', 'cone', 'greenlight')
 
-def run(model: str, camera_id: int, width: int, height: int, num_threads: int,
-        enable_edgetpu: bool, fc) -> None:
-  """Continuously run inference on images acquired from the camera.
+# One detected object. bbox is (x, y, width, height) in pixels and
+# timestamp is the time.monotonic() the frame was captured.
+Detection = collections.namedtuple(
+    'Detection', ['category', 'score', 'bbox', 'timestamp'])
 
-  Args:
-    model: Name of the TFLite object detection model.
-    camera_id: The camera id to be passed to OpenCV.
-    width: The width of the frame captured from the camera.
-    height: The height of the frame captured from the camera.
-    num_threads: The number of CPU threads to run the model.
-    enable_edgetpu: True/False whether the model is a EdgeTPU model.
+
+class DetectionCache(object):
+  """Thread-safe holder of the newest frame's detections."""
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._detections = []
+    self.timestamp = None  # capture time of the frame the detections came from
+    self.frames = 0
+
+  def publish(self, detections: list, timestamp: float) -> None:
+    with self._lock:
+      self._detections = detections
+      self.timestamp = timestamp
+      self.frames += 1
+
+  def latest(self, max_age: float = None) -> list:
+    """The newest detections, or [] if they are older than max_age seconds."""
+    with self._lock:
+      if self.timestamp is None:
+        return []
+      if max_age is not None and time.monotonic() - self.timestamp > max_age:
+        return []
+      return list(self._detections)
+
+
+class DetectorService(object):
+  """Keeps the camera open and the model loaded between detections.
+
+  Opening the camera and building the detector take hundreds of ms to
+  seconds, so they happen once in start() and every detect_latest() call
+  costs a frame grab and one inference.
+
+  After start_background() a grabber thread keeps only the newest camera
+  frame and an inference thread runs the model on it as fast as it can,
+  publishing to self.cache. Frames that arrive while inference is busy
+  are dropped, and detect_latest() just reads the cache.
   """
 
-  # Variables to calculate FPS
-  counter, fps = 0, 0
-  start_time = time.time()
-  directional = False
-  # Start capturing video input from the camera
-  cap = cv2.VideoCapture(camera_id)
-  # default also 480
-  cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-  cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-  # go to 480p
-  # cap.set(3, 640)
-  # cap.set(4, 480)
-  # go to 240p
-  # cap.set(3, 320)
-  # cap.set(4, 240)
-
-  # Visualization parameters
-  row_size = 20  # pixels
-  left_margin = 24  # pixels
-  text_color = (0, 0, 255)  # red
-  font_size = 1
-  font_thickness = 1
-  fps_avg_frame_count = 10
-
-  # Initialize the object detection model
-  base_options = core.BaseOptions(
-      file_name=model, use_coral=enable_edgetpu, num_threads=num_threads)
-  detection_options = processor.DetectionOptions(
-      max_results=2, score_threshold=0.3)
-  options = vision.ObjectDetectorOptions(
-      base_options=base_options, detection_options=detection_options)
-  detector = vision.ObjectDetector.create_from_options(options)
-
-  # Continuously capture images from the camera and run inference
-  # while cap.isOpened():
-  if cap.isOpened():
-    success, image = cap.read()
+  def __init__(self, model: str = './model2.tflite', camera_id: int = 0,
+               width: int = 320, height: int = 240, num_threads: int = 4,
+               enable_edgetpu: bool = False, score_threshold: float = 0.5,
+               image_logger: ImageLogger = None, show: bool = False,
+               preprocessor: Preprocessor = None) -> None:
+    self.model = model
+    self.camera_id = camera_id
+    self.width = width
+    self.height = height
+    self.num_threads = num_threads
+    self.enable_edgetpu = enable_edgetpu
+    self.score_threshold = score_threshold
+    # None turns photo logging off, show opens a preview window
+    self.image_logger = image_logger
+    self.show = show
+    # None runs the detector on every full frame
+    self.preprocessor = preprocessor
+    self.inferences = 0
+    self._last_detections = []
+    self.cap = None
+    self.detector = None
+    self._lock = threading.Lock()
+    self.cache = DetectionCache()
+    self.dropped_frames = 0
+    self._frame = None  # (seq, timestamp, image) from the grabber thread
+    self._frame_ready = threading.Condition()
+    self._stopped = threading.Event()
+    self._threads = []
+
+  def start(self) -> 'DetectorService':
+    with self._lock:
+      if self.detector is not None:
+        return self
+      # Start capturing video input from the camera
+      self.cap = cv2.VideoCapture(self.camera_id)
+      # default also 480
+      self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+      self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+      # Only keep the newest frame so a grab never returns a stale one
+      self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+      # Initialize the object detection model
+      base_options = core.BaseOptions(
+          file_name=self.model, use_coral=self.enable_edgetpu,
+          num_threads=self.num_threads)
+      detection_options = processor.DetectionOptions(
+          max_results=2, score_threshold=0.3)
+      options = vision.ObjectDetectorOptions(
+          base_options=base_options, detection_options=detection_options)
+      self.detector = vision.ObjectDetector.create_from_options(options)
+    return self
+
+  def start_background(self) -> 'DetectorService':
+    self.start()
+    if self._threads:
+      return self
+    self._stopped.clear()
+    self._threads = [
+        threading.Thread(target=self._grab_loop, name='DetectorGrab', daemon=True),
+        threading.Thread(target=self._infer_loop, name='DetectorInfer', daemon=True),
+    ]
+    for thread in self._threads:
+      thread.start()
+    return self
+
+  def close(self) -> None:
+    self._stopped.set()
+    with self._frame_ready:
+      self._frame_ready.notify_all()
+    for thread in self._threads:
+      thread.join()
+    self._threads = []
+    with self._lock:
+      if self.cap is not None:
+        self.cap.release()
+      if self.image_logger is not None:
+        self.image_logger.close()
+        self.image_logger = None
+      self.cap = None
+      self.detector = None
+
+  def detect_latest(self) -> list:
+    """Return the Detections above the threshold in the newest frame.
+
+    In background mode this is a cache read, otherwise it grabs the
+    current frame and runs one inference.
+    """
+    if self._threads:
+      return self.cache.latest()
+    self.start()
+    with self._lock:
+      if not self.cap.isOpened():
+        return []
+      success, image = self.cap.read()
+      timestamp = time.monotonic()
     if not success:
       sys.exit(
           'ERROR: Unable to read from webcam. Please verify your webcam settings.'
       )
+    detections = self._infer(image, timestamp)
+    self._publish(detections, timestamp)
+    return detections
 
-    counter += 1
-    image = cv2.flip(image, 1)
+  def _publish(self, detections: list, timestamp: float) -> None:
+    self.cache.publish(detections, timestamp)
+    # no-op unless picar_4wd is recording the run
+    recorder = _recorder()
+    if recorder is not None:
+      recorder.record_detections(detections, timestamp)
 
-    # Convert the image from BGR to RGB as required by the TFLite model.
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+  def _grab_loop(self) -> None:
+    seq = 0
+    while not self._stopped.is_set():
+      with self._lock:
+        success, image = self.cap.read()
+      timestamp = time.monotonic()
+      if not success:
+        print('ERROR: Unable to read from webcam.')
+        self._stopped.wait(1)
+        continue
+      seq += 1
+      with self._frame_ready:
+        # Replace whatever frame inference has not picked up yet
+        self._frame = (seq, timestamp, image)
+        self._frame_ready.notify()
+
+  def _infer_loop(self) -> None:
+    last_seq = 0
+    while not self._stopped.is_set():
+      with self._frame_ready:
+        self._frame_ready.wait_for(
+            lambda: self._stopped.is_set() or
+            (self._frame is not None and self._frame[0] != last_seq))
+        if self._stopped.is_set():
+          return
+        seq, timestamp, image = self._frame
+      if last_seq:
+        self.dropped_frames += seq - last_seq - 1
+      last_seq = seq
+      self._publish(self._infer(image, timestamp), timestamp)
+
+  def _infer(self, image, timestamp: float) -> list:
+    if self.preprocessor is not None:
+      prepared = self.preprocessor.process(image)
+      if prepared is None:
+        # Nothing moved, the last detections still hold for this frame
+        return [det._replace(timestamp=timestamp) for det in self._last_detections]
+      rgb_image, image = prepared
+      offset_x, offset_y = self.preprocessor.offset
+    else:
+      image = cv2.flip(image, 1)
+      # Convert the image from BGR to RGB as required by the TFLite model.
+      rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+      offset_x, offset_y = 0, 0
 
     # Create a TensorImage object from the RGB image.
     input_tensor = vision.TensorImage.create_from_array(rgb_image)
 
     # Run object detection estimation using the model.
-    detection_result = detector.detect(input_tensor)
-    
+    detection_result = self.detector.detect(input_tensor)
+    self.inferences += 1
+
+    detections = []
     for det in detection_result.detections:
-      if det.categories:
-        for cat in det.categories:
-          if cat.score >= 0.5:
-            if cat.category_name == 'stopsign' :
-              directional = 'stopsign'
-              # fc.logger.info('stopsign detected')
-            elif cat.category_name == 'redlight':
-              directional = 'redlight'
-              # fc.logger.info('redlight detected')
-            elif cat.category_name == 'yellowlight':
-              directional = 'yellowlight'
-              # fc.logger.info('yellowlight detected')
-            elif cat.category_name == 'cone':
-              # fc.logger.info('cone detected')
-              directional = 'cone'
-            elif cat.category_name == 'greenlight':
-              # fc.logger.info('greenlight detected')
-              directional = 'greenlight'
-              pass
-            
-
-    # Draw keypoints and edges on input image
-    img = utils.visualize(image, detection_result)
-
-    image = cv2.flip(img, 0)
-    filename = './photos/'+  str(int(time.time())) +'.jpg'
-    cv2.imwrite(filename, image)
-    
-    cv2.imshow('object_detector', image)
-  cap.release()
+      box = det.bounding_box
+      for cat in det.categories:
+        if cat.score >= self.score_threshold:
+          detections.append(Detection(
+              cat.category_name, cat.score,
+              (box.origin_x + offset_x, box.origin_y + offset_y, box.width,
+               box.height), timestamp))
+    self._last_detections = detections
+
+    if self.image_logger is not None:
+      self.image_logger.log(image, detection_result, detections)
+
+    # HighGUI windows only work from the main thread
+    if self.show and threading.current_thread() is threading.main_thread():
+      cv2.imshow('object_detector', image)
+      cv2.waitKey(1)
+    return detections
+
+
+def _recorder():
+  """picar_4wd's recorder module, or None when picar_4wd isn't installed.
+
+  Imported on use so detection still runs on a machine without the car.
+  """
+  try:
+    from picar_4wd import recorder
+  except ImportError:
+    return None
+  return recorder
+
+
+class ReplayDetector(object):
+  """Stands in for DetectorService while picar_4wd replays a recording.
+
+  It never opens the camera or the model. cache.latest() returns the
+  recorded frame matching the replay's position in the run.
+  """
+
+  def __init__(self, replay: 'recorder.Replay', width: int = 320,
+               height: int = 240) -> None:
+    self.replay = replay
+    self.width = width
+    self.height = height
+    self.cache = self
+    self.inferences = 0
+    self.dropped_frames = 0
+    self.frames = 0
+    self.timestamp = None
+
+  def start(self) -> 'ReplayDetector':
+    return self
+
+  def start_background(self) -> 'ReplayDetector':
+    return self
+
+  def close(self) -> None:
+    pass
+
+  def detect_latest(self) -> list:
+    return self.latest()
+
+  def latest(self, max_age: float = None) -> list:
+    t, rows = self.replay.detections()
+    if t is None:
+      return []
+    if max_age is not None and (self.replay.now() - t) / 1e9 > max_age:
+      return []
+    timestamp = t / 1e9
+    if timestamp != self.timestamp:
+      self.timestamp = timestamp
+      self.frames += 1
+    return [Detection(category, score, bbox, timestamp)
+            for category, score, bbox in rows]
+
+
+def label_for(detections) -> str:
+  """The traffic category to obey, or False when nothing relevant was seen."""
+  directional = False
+  for det in detections:
+    if det.category in LABELS:
+      directional = det.category
   return directional
 
 
+_service = None
+
+def get_service() -> DetectorService:
+  """Return the shared DetectorService, opened on first use."""
+  global _service
+  recorder = _recorder() if _service is None else None
+  if recorder is not None and recorder.active_replay() is not None:
+    _service = ReplayDetector(recorder.active_replay())
+  if _service is None:
+    # keep annotated frames that had something in them, capped at 500 files
+    # and only run the model when the scene changes
+    _service = DetectorService(
+        image_logger=ImageLogger(only_detections=True, max_files=500),
+        preprocessor=Preprocessor(320, 240)).start()
+  return _service
+
+
+def run(model: str, camera_id: int, width: int, height: int, num_threads: int,
+        enable_edgetpu: bool, fc) -> None:
+  """Run inference once on an image acquired from the camera.
+
+  Opens and releases the camera and model on every call, prefer
+  detect_latest() on a DetectorService that stays open.
+
+  Args:
+    model: Name of the TFLite object detection model.
+    camera_id: The camera id to be passed to OpenCV.
+    width: The width of the frame captured from the camera.
+    height: The height of the frame captured from the camera.
+    num_threads: The number of CPU threads to run the model.
+    enable_edgetpu: True/False whether the model is a EdgeTPU model.
+  """
+  service = DetectorService(model, camera_id, width, height, num_threads,
+                            enable_edgetpu, image_logger=ImageLogger())
+  try:
+    return label_for(service.detect_latest())
+  finally:
+    service.close()
+
+
 def start(fc):
-  model = './model2.tflite'
-  cameraId = 0
-  frameWidth = 320
-  frameHeight = 240
-  numThreads = 4
-  enableEdgeTPU = False
-
-  run(model, int(cameraId), frameWidth, frameHeight,
-      int(numThreads), bool(enableEdgeTPU), fc)
\ No newline at end of file
+  return label_for(get_service().detect_latest())
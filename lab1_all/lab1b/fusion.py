@@ -0,0 +1,92 @@
+import math
+from typing import Dict, List, Tuple
+from helper_classes import Coordinate
+
+# real widths (cm) of the objects the detector knows, used to range them from
+# their width in pixels
+KNOWN_WIDTHS_CM = {
+    'cone': 8.0,
+    'stopsign': 7.0,
+}
+
+
+class CameraModel(object):
+    """Pinhole model of the car camera, in detector frame pixels.
+
+    Bearings use the servo convention: 0 is straight ahead, positive is to
+    the left of the car, negative to the right.
+    """
+
+    def __init__(
+        self,
+        width: int = 320,
+        height: int = 240,
+        hfov_deg: float = 62.2, # Raspberry Pi camera v2
+        mirrored: bool = False, # set if things left of the car show up on the right of the detector's frame
+        forward_offset_cm: float = 0 # how far in front of the ultrasonic sensor the camera sits
+    ) -> None:
+        self.width = width
+        self.height = height
+        self.cx = width / 2
+        # focal length in pixels
+        self.fx = self.cx / math.tan(math.radians(hfov_deg) / 2)
+        self.mirrored = mirrored
+        self.forward_offset_cm = forward_offset_cm
+
+    def bearing(self, u: float) -> float:
+        angle = math.degrees(math.atan((self.cx - u) / self.fx))
+        return -angle if self.mirrored else angle
+
+    def distance(self, pixel_width: float, real_width_cm: float, bearing: float = 0) -> float:
+        # depth from similar triangles, then along the ray to the object
+        depth = self.fx * real_width_cm / max(pixel_width, 1)
+        return depth / math.cos(math.radians(bearing)) + self.forward_offset_cm
+
+
+def ultrasonic_distance(scan: List[Tuple[float, int]], bearing: float, tolerance: float) -> float:
+    # closest ultrasonic reading within tolerance degrees of the bearing, or None
+    best = None
+    for distance, angle in scan or []:
+        if abs(angle - bearing) <= tolerance and (best is None or distance < best):
+            best = distance
+    return best
+
+
+def detection_cells(
+    detections: list,
+    picar,
+    camera: CameraModel,
+    scan: List[Tuple[float, int]] = None,
+    categories: Tuple[str, ...] = ('cone',),
+    known_widths: Dict[str, float] = KNOWN_WIDTHS_CM,
+    max_dist: float = 100,
+    tolerance: float = 10
+) -> List[Coordinate]:
+    """Map cells covered by the detected objects that the car should drive around.
+
+    Each box is turned into the bearings of its left and right edges. The
+    range comes from the matching ultrasonic reading when the sweep saw
+    something at that bearing, otherwise from the object's known width.
+    The cells between the two edges are returned in absolute map
+    coordinates, from the car's current location and direction.
+    """
+    cells = []
+    for det in detections:
+        if det.category not in categories:
+            continue
+        x, y, w, h = det.bbox
+        left = camera.bearing(x)
+        right = camera.bearing(x + w)
+        center = (left + right) / 2
+        distance = ultrasonic_distance(scan, center, tolerance)
+        if distance is None:
+            if det.category not in known_widths:
+                continue
+            distance = camera.distance(w, known_widths[det.category], center)
+        if distance > max_dist:
+            continue
+        edge1 = picar.get_cartesian(angle=left, distance=distance)
+        edge2 = picar.get_cartesian(angle=right, distance=distance)
+        # the edges are at most an object width apart, always fill between them
+        cells.extend(picar.supercover_line(edge1, edge2, math.inf))
+    return sorted(set(cells))
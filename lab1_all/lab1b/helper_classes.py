@@ -42,6 +42,9 @@ class Maze(object):
         self.y_length = y_length
         self.maze = np.zeros(shape=(x_length, y_length))
         self.shape = (x_length, y_length)
+        # called with the coordinate and previous value of every cell that changes,
+        # so planners can drop what they cached about it
+        self.listeners = []
         self.logger = logging.getLogger()
         logging.basicConfig(format='%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
                 datefmt='%Y-%m-%d:%H:%M:%S',
@@ -62,12 +65,39 @@ class Maze(object):
     def __len__(self):
         return self.maze.shape[0]
     
+    def add_listener(self, listener) -> None:
+        self.listeners.append(listener)
+
+    # write to the map through here rather than self.maze so listeners hear about it
+    def set_cell(self, coord: Coordinate, value: int) -> None:
+        old = self.maze[coord.x, coord.y]
+        if old != value:
+            self.maze[coord.x, coord.y] = value
+            for listener in self.listeners:
+                listener(coord, old)
+
     # mark object only if within boundaries of the map
     def mark_object(self, coord1: Coordinate, x_lower: int, x_upper: int, y_lower: int, y_upper: int) -> None:
         if coord1.x >= x_lower and coord1.x < x_upper and coord1.y >= y_lower and coord1.y < y_upper:
-            self.maze[coord1.x, coord1.y] = 1
-            
-            
+            self.set_cell(coord1, 1)
+
+    # remove every object from the map
+    def clear(self) -> None:
+        xs, ys = np.nonzero(self.maze)
+        old = self.maze[xs, ys]
+        self.maze.fill(0)
+        for x, y, value in zip(xs.tolist(), ys.tolist(), old.tolist()):
+            for listener in self.listeners:
+                listener(Coordinate(x, y), value)
+
+    # the map around coord with coord itself marked, for printing while debugging
+    def around(self, coord: Coordinate, radius: int = 5, marker: int = 4) -> str:
+        x0, y0 = max(coord.x - radius, 0), max(coord.y - radius, 0)
+        window = self.maze[x0:coord.x + radius + 1, y0:coord.y + radius + 1].copy()
+        window[coord.x - x0, coord.y - y0] = marker
+        return str(window)
+
+
 
 # hold the directions and their corresponding angles from the perspective of going north
 # using polar coordinates with 0 degrees as north and negative angles since the ultrasonic sensor
@@ -0,0 +1,376 @@
+import heapq
+import math
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from helper_classes import Coordinate, Maze
+try:
+    from picar_4wd import trace
+    traced = trace.traced
+except ImportError:
+    # planning also runs off the car without the picar_4wd stack
+    def traced(name=None):
+        return lambda func: func
+
+Cell = Tuple[int, int]
+
+# offsets of the four clusters that share a border with a cluster
+SIDES = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+
+def manhattan(a: Cell, b: Cell) -> int:
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+class _LocalPaths(object):
+    # shortest paths from one cell to every cell of its cluster. In a cluster
+    # without obstacles they are plain L shapes, so nothing is searched
+    __slots__ = ('origin', 'dist', 'parents')
+
+    def __init__(self, origin: Cell, dist: Dict[Cell, int] = None, parents: Dict[Cell, Cell] = None) -> None:
+        self.origin = origin
+        self.dist = dist
+        self.parents = parents
+
+    def cost(self, cell: Cell) -> Optional[int]:
+        if self.dist is None:
+            return manhattan(self.origin, cell)
+        return self.dist.get(cell)
+
+    def path(self, cell: Cell) -> List[Cell]:
+        if self.dist is None:
+            (x0, y0), (x1, y1) = self.origin, cell
+            step_x = 1 if x1 >= x0 else -1
+            step_y = 1 if y1 >= y0 else -1
+            path = [(x, y0) for x in range(x0, x1 + step_x, step_x)]
+            path.extend((x1, y) for y in range(y0 + step_y, y1 + step_y, step_y))
+            return path
+        path = []
+        while cell is not None:
+            path.append(cell)
+            cell = self.parents[cell]
+        path.reverse()
+        return path
+
+
+class _Cluster(object):
+    __slots__ = ('key', 'x0', 'y0', 'x1', 'y1', 'blocked', 'weights', 'links', 'paths')
+
+    def __init__(self, key: Cell, x0: int, y0: int, x1: int, y1: int, blocked, weights) -> None:
+        self.key = key
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+        # None when the cluster has no obstacles and uniform costs, otherwise rows of booleans
+        self.blocked = blocked
+        # None when every cell costs 1, otherwise rows of step costs
+        self.weights = weights
+        # entrance cell -> cells across the border it connects to
+        self.links: Dict[Cell, List[Cell]] = {}
+        # entrance cell -> _LocalPaths, filled in as the search reaches it
+        self.paths: Dict[Cell, _LocalPaths] = {}
+
+
+class HierarchicalPlanner(object):
+    """Coarse-to-fine path planner over a Maze (HPA*).
+
+    The map is split into cluster_size x cluster_size clusters. Where two
+    neighbouring clusters share a run of free border cells, the run gets
+    one entrance, or one at each end if it is at least min_split cells
+    long. A query searches the graph of entrances, moving between them
+    with the cached shortest paths inside each cluster, then expands only
+    the chosen entrances into cells.
+
+    Everything is built lazily for the clusters a query touches. The
+    planner listens to the Maze's changes, and before a query every cell
+    that holds an object now but didn't before, or the other way round,
+    drops the cached data of the cluster it lands in and of its
+    neighbours. Clearing the map and marking the same objects again keeps
+    the cache. Clusters without obstacles need no search at all, so a
+    long query over open ground costs a few steps per cluster crossed.
+
+    Paths are 4-connected like astar()'s but not always the shortest,
+    since they have to pass through entrances. There is no fixed bound.
+    Queries across several clusters usually come out within 10% of the
+    shortest path. A short query that crosses a border away from its
+    entrances can take a detour twice as long as the direct route or
+    more. Use astar() when that matters.
+
+    With an InflationLayer as costs, its blocked cells count as obstacles
+    and clusters near objects are searched with its step costs.
+    """
+
+    def __init__(self, maze: Maze, cluster_size: int = 50, min_split: int = 6, costs=None) -> None:
+        self.maze = maze
+        self.costs = costs
+        self.cluster_size = cluster_size
+        self.min_split = min_split
+        self._clusters: Dict[Cell, _Cluster] = {}
+        self._borders: Dict[Tuple[Cell, Cell], List[Tuple[Cell, Cell]]] = {}
+        # abstract nodes expanded by the last query
+        self.expanded = 0
+        # cell -> whether it held an object before it first changed since the last query
+        self._changes: Dict[Cell, bool] = {}
+        maze.add_listener(self._changed)
+
+    def _changed(self, coord: Coordinate, old) -> None:
+        self._changes.setdefault((coord.x, coord.y), old == 1)
+
+    def _flush(self) -> None:
+        # only cells that ended up different from what the cache was built on count
+        changes, self._changes = self._changes, {}
+        for (x, y), was in changes.items():
+            if (self.maze.maze[x, y] == 1) != was:
+                self.invalidate(Coordinate(x, y))
+
+    def invalidate(self, coord: Coordinate = None) -> None:
+        """Forget what was cached about the cluster around coord, or about the whole map."""
+        if coord is None:
+            self._clusters.clear()
+            self._borders.clear()
+            return
+        # an object changes the inflation costs up to margin cells around it
+        margin = self.costs.margin if self.costs is not None else 0
+        low = self._key((coord.x - margin, coord.y - margin))
+        high = self._key((coord.x + margin, coord.y + margin))
+        for kx in range(low[0], high[0] + 1):
+            for ky in range(low[1], high[1] + 1):
+                key = (kx, ky)
+                self._clusters.pop(key, None)
+                for dx, dy in SIDES:
+                    other = (kx + dx, ky + dy)
+                    # the neighbour's entrances on the shared border may have moved
+                    self._clusters.pop(other, None)
+                    self._borders.pop((min(key, other), max(key, other)), None)
+
+    def _key(self, cell: Cell) -> Cell:
+        return cell[0] // self.cluster_size, cell[1] // self.cluster_size
+
+    def _bounds(self, key: Cell) -> Tuple[int, int, int, int]:
+        x0 = key[0] * self.cluster_size
+        y0 = key[1] * self.cluster_size
+        return x0, y0, min(x0 + self.cluster_size, self.maze.shape[0]), min(y0 + self.cluster_size, self.maze.shape[1])
+
+    def _blocked(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        blocked = self.maze.maze[x0:x1, y0:y1] == 1
+        if self.costs is not None:
+            blocked |= self.costs.window(x0, y0, x1, y1)[0]
+        return blocked
+
+    def _weight(self, cell: Cell) -> float:
+        return 1 if self.costs is None else self.costs.cost(cell[0], cell[1])
+
+    def _exists(self, key: Cell) -> bool:
+        return (0 <= key[0] * self.cluster_size < self.maze.shape[0] and
+                0 <= key[1] * self.cluster_size < self.maze.shape[1])
+
+    def _cluster(self, key: Cell) -> _Cluster:
+        cluster = self._clusters.get(key)
+        if cluster is not None:
+            return cluster
+        x0, y0, x1, y1 = self._bounds(key)
+        block = self._blocked(x0, y0, x1, y1)
+        weights = None
+        if self.costs is not None:
+            costs = self.costs.window(x0, y0, x1, y1)[1]
+            if (costs > 1).any():
+                weights = costs.tolist()
+        cluster = _Cluster(key, x0, y0, x1, y1,
+                           block.tolist() if block.any() or weights is not None else None, weights)
+        for dx, dy in SIDES:
+            other = (key[0] + dx, key[1] + dy)
+            if not self._exists(other):
+                continue
+            for a, b in self._border(min(key, other), max(key, other)):
+                # a lies in the lower keyed cluster
+                inside, outside = (a, b) if key < other else (b, a)
+                cluster.links.setdefault(inside, []).append(outside)
+        self._clusters[key] = cluster
+        return cluster
+
+    def _border(self, low: Cell, high: Cell) -> List[Tuple[Cell, Cell]]:
+        # entrance pairs between two neighbouring clusters, low < high
+        border = self._borders.get((low, high))
+        if border is not None:
+            return border
+        lx0, ly0, lx1, ly1 = self._bounds(low)
+        if high[0] != low[0]:
+            # high is below low, the border runs along y
+            first = ly0
+            free = ~self._blocked(lx1 - 1, ly0, lx1 + 1, ly1).any(axis=0)
+            window = (lx1 - 1, ly0, lx1 + 1, ly1)
+            pair = lambda i: ((lx1 - 1, i), (lx1, i))
+        else:
+            first = lx0
+            free = ~self._blocked(lx0, ly1 - 1, lx1, ly1 + 1).any(axis=1)
+            window = (lx0, ly1 - 1, lx1, ly1 + 1)
+            pair = lambda i: ((i, ly1 - 1), (i, ly1))
+        # step costs across the border, so long runs also get their cheapest cell
+        weights = None
+        if self.costs is not None:
+            weights = self.costs.window(*window)[1].sum(axis=0 if high[0] != low[0] else 1).tolist()
+        border = []
+        run_start = None
+        # the extra False closes a run that reaches the end of the border
+        for i, is_free in enumerate(free.tolist() + [False], first):
+            if is_free and run_start is None:
+                run_start = i
+            elif not is_free and run_start is not None:
+                run_end = i - 1
+                if run_end - run_start + 1 >= self.min_split:
+                    border.append(pair(run_start))
+                    border.append(pair(run_end))
+                    # a run of two cells has no cells between its ends
+                    if weights is not None and run_end - run_start >= 2:
+                        middle = (run_start + run_end) / 2
+                        cheapest = min(range(run_start + 1, run_end),
+                                       key=lambda j: (weights[j - first], abs(j - middle)))
+                        border.append(pair(cheapest))
+                else:
+                    border.append(pair((run_start + run_end) // 2))
+                run_start = None
+        self._borders[(low, high)] = border
+        return border
+
+    def _search(self, cluster: _Cluster, origin: Cell) -> _LocalPaths:
+        # breadth first search from origin over the free cells of the cluster
+        if cluster.blocked is None:
+            return _LocalPaths(origin)
+        if cluster.weights is not None:
+            return self._weighted_search(cluster, origin)
+        blocked = cluster.blocked
+        x0, y0, x1, y1 = cluster.x0, cluster.y0, cluster.x1, cluster.y1
+        dist = {origin: 0}
+        parents = {origin: None}
+        queue = deque([origin])
+        while queue:
+            current = queue.popleft()
+            d = dist[current] + 1
+            x, y = current
+            for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if (x0 <= nx < x1 and y0 <= ny < y1 and not blocked[nx - x0][ny - y0]
+                        and (nx, ny) not in dist):
+                    dist[(nx, ny)] = d
+                    parents[(nx, ny)] = current
+                    queue.append((nx, ny))
+        return _LocalPaths(origin, dist, parents)
+
+    def _weighted_search(self, cluster: _Cluster, origin: Cell) -> _LocalPaths:
+        # Dijkstra from origin, a step costs the weight of the cell it enters
+        blocked, weights = cluster.blocked, cluster.weights
+        x0, y0, x1, y1 = cluster.x0, cluster.y0, cluster.x1, cluster.y1
+        dist = {origin: 0}
+        parents = {origin: None}
+        heap = [(0, origin)]
+        while heap:
+            d, current = heapq.heappop(heap)
+            if d > dist[current]:
+                continue
+            x, y = current
+            for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if x0 <= nx < x1 and y0 <= ny < y1 and not blocked[nx - x0][ny - y0]:
+                    nd = d + weights[nx - x0][ny - y0]
+                    if nd < dist.get((nx, ny), math.inf):
+                        dist[(nx, ny)] = nd
+                        parents[(nx, ny)] = current
+                        heapq.heappush(heap, (nd, (nx, ny)))
+        return _LocalPaths(origin, dist, parents)
+
+    def _paths_from(self, cluster: _Cluster, cell: Cell) -> _LocalPaths:
+        paths = cluster.paths.get(cell)
+        if paths is None:
+            paths = cluster.paths[cell] = self._search(cluster, cell)
+        return paths
+
+    @traced("hpastar")
+    def find_path(self, start: Coordinate, end: Coordinate) -> Optional[List[Coordinate]]:
+        """Path from start to end as a list of Coordinates like astar(), or None."""
+        s = (start.x, start.y)
+        e = (end.x, end.y)
+        shape = self.maze.shape
+        if self.costs is not None:
+            self.costs.update()
+        self._flush()
+        if not (0 <= e[0] < shape[0] and 0 <= e[1] < shape[1]) or self.maze.maze[e] == 1:
+            return None
+        if self.costs is not None and self.costs.is_blocked(e[0], e[1]):
+            return None
+        if s == e:
+            return [start]
+        end_key = self._key(e)
+
+        # the start is not an entrance, its searches are not cached
+        local = {s: self._search(self._cluster(self._key(s)), s)}
+        g = {s: 0}
+        parents: Dict[Cell, Optional[Cell]] = {s: None}
+        heap = [(manhattan(s, e), 0, s)]
+        closed = set()
+        self.expanded = 0
+        while heap:
+            _, _, node = heapq.heappop(heap)
+            if node == e:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+            self.expanded += 1
+            cluster = self._cluster(self._key(node))
+            paths = local.get(node) or self._paths_from(cluster, node)
+            steps = [(other, paths.cost(other)) for other in cluster.links if other != node]
+            if cluster.key == end_key:
+                steps.append((e, paths.cost(e)))
+            steps.extend((other, self._weight(other)) for other in cluster.links.get(node, ()))
+            for other, cost in steps:
+                if cost is None:
+                    continue
+                new_g = g[node] + cost
+                if new_g < g.get(other, new_g + 1):
+                    g[other] = new_g
+                    parents[other] = node
+                    h = manhattan(other, e)
+                    # ties go to the node closer to the end
+                    heapq.heappush(heap, (new_g + h, h, other))
+        if e not in parents:
+            return None
+
+        nodes = []
+        node = e
+        while node is not None:
+            nodes.append(node)
+            node = parents[node]
+        nodes.reverse()
+
+        # refine: expand every hop inside a cluster into its cells
+        path = [s]
+        for a, b in zip(nodes, nodes[1:]):
+            if self._key(a) != self._key(b):
+                path.append(b)
+                continue
+            paths = local.get(a) or self._paths_from(self._cluster(self._key(a)), a)
+            path.extend(paths.path(b)[1:])
+        return [Coordinate(x, y) for x, y in path]
+
+
+if __name__ == "__main__":
+
+    import time
+    from astar import astar
+
+    maze = Maze(3000, 3000)
+    planner = HierarchicalPlanner(maze)
+    rng = np.random.default_rng(0)
+    for x, y in rng.integers(0, 400, size=(3000, 2)):
+        maze.mark_object(Coordinate(x, y), 0, 3000, 0, 3000)
+
+    start = Coordinate(0, 0)
+    for end in (Coordinate(150, 100), Coordinate(390, 380), Coordinate(2900, 2900)):
+        maze.set_cell(end, 0)
+        t = time.perf_counter()
+        path = planner.find_path(start, end)
+        first = time.perf_counter() - t
+        t = time.perf_counter()
+        path = planner.find_path(start, end)
+        cached = time.perf_counter() - t
+        print(f"hpa* to {end}: {len(path)} cells, {first * 1000:.1f}ms cold, {cached * 1000:.1f}ms cached, {planner.expanded} nodes")
+        if end.x < 1000:
+            t = time.perf_counter()
+            exact = astar(maze, start, end)
+            print(f"a*   to {end}: {len(exact)} cells, {(time.perf_counter() - t) * 1000:.1f}ms")
@@ -0,0 +1,91 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import utils
+
+
+class ImageLogger:
+    """Saves annotated detector frames from a background writer thread.
+
+    log() only decides whether a frame is sampled and queues it. Drawing
+    the boxes, encoding and writing the JPEG all happen on the writer
+    thread, so the caller never waits on the SD card. The queue is
+    bounded: when the writer falls behind, new frames are dropped rather
+    than piling up in memory. Only the newest max_files images are kept.
+
+    To turn logging off, pass no logger at all. The detector then skips
+    the call entirely.
+    """
+
+    def __init__(
+        self,
+        directory: str = './photos',
+        every_n: int = 1, # keep every Nth sampled frame
+        only_detections: bool = False, # skip frames where nothing was detected
+        max_files: int = 500,
+        queue_size: int = 8
+    ) -> None:
+        self.directory = directory
+        self.every_n = max(1, every_n)
+        self.only_detections = only_detections
+        self.max_files = max_files
+        self.seen = 0
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        os.makedirs(directory, exist_ok=True)
+        # pick up what earlier runs left behind so retention covers them too
+        existing = sorted(f for f in os.listdir(directory) if f.endswith('.jpg'))
+        self._files = deque(os.path.join(directory, f) for f in existing)
+        self._thread = threading.Thread(target=self._write_loop, name='ImageLogger', daemon=True)
+        self._thread.start()
+
+    def log(self, image, detection_result, detections) -> bool:
+        """Queue a frame for writing, returns whether it was taken."""
+        if self.only_detections and not detections:
+            return False
+        self.seen += 1
+        if (self.seen - 1) % self.every_n:
+            return False
+        try:
+            # the caller may reuse its buffer, only sampled frames pay for the copy
+            self._queue.put_nowait((image.copy(), detection_result, time.time()))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def close(self) -> None:
+        """Write out what is queued, then stop the writer."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            image, detection_result, timestamp = item
+            try:
+                self._write(image, detection_result, timestamp)
+            except Exception as e:
+                print(f'image logger failed to write a frame: {e}')
+
+    def _write(self, image, detection_result, timestamp) -> None:
+        # Draw keypoints and edges on input image
+        img = utils.visualize(image, detection_result)
+        img = cv2.flip(img, 0)
+        # millisecond names sort by time and don't collide within a second
+        filename = os.path.join(self.directory, f'{int(timestamp * 1000)}.jpg')
+        cv2.imwrite(filename, img)
+        self.written += 1
+        self._files.append(filename)
+        while len(self._files) > self.max_files:
+            try:
+                os.remove(self._files.popleft())
+            except OSError:
+                pass
@@ -0,0 +1,135 @@
+import math
+from collections import deque
+from typing import Tuple
+import numpy as np
+from helper_classes import Maze
+try:
+    from scipy import ndimage
+except ImportError:
+    # brushfire() does the same job in pure Python when scipy isn't installed
+    ndimage = None
+
+
+def brushfire(occupied: np.ndarray, limit: float) -> np.ndarray:
+    """Euclidean distance from every cell to the nearest occupied cell.
+
+    Grows a wavefront out of the occupied cells, each cell remembering the
+    obstacle it was reached from. Cells farther than limit are left at inf.
+    """
+    width, height = occupied.shape
+    dist = np.full(occupied.shape, math.inf).tolist()
+    nearest = {}
+    queue = deque()
+    for x, y in zip(*np.nonzero(occupied)):
+        x, y = int(x), int(y)
+        dist[x][y] = 0.0
+        nearest[(x, y)] = (x, y)
+        queue.append((x, y))
+    while queue:
+        x, y = queue.popleft()
+        sx, sy = nearest[(x, y)]
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                nx, ny = x + dx, y + dy
+                if not (0 <= nx < width and 0 <= ny < height):
+                    continue
+                d = math.hypot(nx - sx, ny - sy)
+                if d <= limit and d < dist[nx][ny]:
+                    dist[nx][ny] = d
+                    nearest[(nx, ny)] = (sx, sy)
+                    queue.append((nx, ny))
+    return np.array(dist)
+
+
+class InflationLayer(object):
+    """Clearance costs around the objects on a Maze, from a distance transform.
+
+    Cells closer than inflate_radius to an object are blocked, use half the
+    car's width so the middle of the car can follow the path. Between
+    inflate_radius and soft_radius a cell costs up to 1 + soft_weight to
+    enter, falling off quadratically, so paths keep their distance from
+    objects when a small detour allows it. Everything else costs 1.
+
+    The transform only covers the bounding box of the objects plus
+    soft_radius. It is recomputed once by the first update() after the
+    objects on the maze changed, with scipy.ndimage when available,
+    otherwise with brushfire(). Clearing the maze and marking the same
+    objects again is not a change.
+    """
+
+    def __init__(self, maze: Maze, inflate_radius: float, soft_radius: float, soft_weight: float = 4.0) -> None:
+        self.maze = maze
+        self.inflate_radius = inflate_radius
+        self.soft_radius = max(soft_radius, inflate_radius)
+        self.soft_weight = soft_weight
+        # how far from an object its costs reach
+        self.margin = int(math.ceil(self.soft_radius))
+        self.origin = None  # (x, y) of the box, None while the map is empty
+        self.blocked = None
+        self.costs = None
+        self.updates = 0
+        self._dirty = True
+        # cell -> whether it held an object before it first changed since the last update
+        self._changes = {}
+        maze.add_listener(self._changed)
+
+    def _changed(self, coord, old) -> None:
+        self._changes.setdefault((coord.x, coord.y), old == 1)
+
+    def update(self) -> None:
+        changes, self._changes = self._changes, {}
+        if not self._dirty:
+            self._dirty = any((self.maze.maze[cell] == 1) != was for cell, was in changes.items())
+        if not self._dirty:
+            return
+        self._dirty = False
+        self.updates += 1
+        xs, ys = np.nonzero(self.maze.maze == 1)
+        if len(xs) == 0:
+            self.origin = self.blocked = self.costs = None
+            return
+        x0 = max(int(xs.min()) - self.margin - 1, 0)
+        y0 = max(int(ys.min()) - self.margin - 1, 0)
+        x1 = min(int(xs.max()) + self.margin + 2, self.maze.shape[0])
+        y1 = min(int(ys.max()) + self.margin + 2, self.maze.shape[1])
+        occupied = self.maze.maze[x0:x1, y0:y1] == 1
+        if ndimage is not None:
+            dist = ndimage.distance_transform_edt(~occupied)
+        else:
+            dist = brushfire(occupied, self.soft_radius)
+        self.origin = (x0, y0)
+        self.blocked = dist <= self.inflate_radius
+        span = max(self.soft_radius - self.inflate_radius, 1e-9)
+        closeness = np.clip((self.soft_radius - dist) / span, 0, 1)
+        self.costs = (1 + self.soft_weight * closeness ** 2).astype(np.float32)
+
+    def is_blocked(self, x: int, y: int) -> bool:
+        if self.origin is None:
+            return False
+        i, j = x - self.origin[0], y - self.origin[1]
+        if 0 <= i < self.blocked.shape[0] and 0 <= j < self.blocked.shape[1]:
+            return bool(self.blocked[i, j])
+        return False
+
+    def cost(self, x: int, y: int) -> float:
+        if self.origin is None:
+            return 1.0
+        i, j = x - self.origin[0], y - self.origin[1]
+        if 0 <= i < self.costs.shape[0] and 0 <= j < self.costs.shape[1]:
+            return float(self.costs[i, j])
+        return 1.0
+
+    def window(self, x0: int, y0: int, x1: int, y1: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(blocked, costs) for the cells [x0, x1) x [y0, y1) of the map."""
+        blocked = np.zeros((x1 - x0, y1 - y0), dtype=bool)
+        costs = np.ones((x1 - x0, y1 - y0), dtype=np.float32)
+        if self.origin is None:
+            return blocked, costs
+        ox, oy = self.origin
+        # overlap of the window and the transformed box, in map cells
+        ax, ay = max(x0, ox), max(y0, oy)
+        bx, by = min(x1, ox + self.blocked.shape[0]), min(y1, oy + self.blocked.shape[1])
+        if ax < bx and ay < by:
+            blocked[ax - x0:bx - x0, ay - y0:by - y0] = self.blocked[ax - ox:bx - ox, ay - oy:by - oy]
+            costs[ax - x0:bx - x0, ay - y0:by - y0] = self.costs[ax - ox:bx - ox, ay - oy:by - oy]
+        return blocked, costs
@@ -1,12 +1,22 @@
-
-from astar import astar
+from hpastar import HierarchicalPlanner
+from inflation import InflationLayer
 from navigate import PiCar
 from helper_classes import Coordinate, Maze, Direction
 import picar_4wd as fc
+from picar_4wd import trace
+from picar_4wd import recorder
 import math
 import numpy as np
 import detect
+import fusion
+from traffic_rules import TrafficRules
 import time
+from navlog import get_navlog
+
+# ignore detections from frames older than this
+DETECTION_MAX_AGE = 0.5
+# rescans in a row that may find no path to the goal before the car gives up
+MAX_NO_PATH_SCANS = 3
 
 def main():
     
@@ -28,13 +38,34 @@ def main():
     
     # initialize the car
     picar = PiCar(start_loc=global_start, goal_loc=global_end)
+    log = picar.log
+
+    # keep the middle of the car half its width away from objects, and stay clear
+    # of them by up to a full car width when a small detour allows it
+    inflation = InflationLayer(global_map, inflate_radius=picar.car_width_cm / 2, soft_radius=picar.car_width_cm)
+    # plans over clusters of the map and only redoes the clusters that new
+    # objects land in, a plain astar() search of the whole grid is too slow
+    planner = HierarchicalPlanner(global_map, costs=inflation)
+    # without inflation, for when the car already stands inside the inflated area
+    fallback_planner = HierarchicalPlanner(global_map)
+
+    # run object detection continuously in the background so the car can react
+    # to traffic while it drives, not only when it stops to scan
+    detector = detect.get_service().start_background()
+    traffic = TrafficRules()
+    picar.traffic_hold = lambda: traffic.update(detector.cache.latest(max_age=DETECTION_MAX_AGE))
+    camera = fusion.CameraModel(width=detector.width, height=detector.height)
 
     # keep track of the cycle so we can periodically clear the map
     cycle = 0
+    # scans in a row that found no path
+    no_path_scans = 0
     
     # navigate the car along the path
     while True:
 
+        # marks where each navigation cycle starts on the trace timeline
+        trace.instant("nav.cycle", location=picar.current_loc)
         path = None
         # starting point (local start) is the car's current location
         local_start = picar.current_loc
@@ -43,20 +74,20 @@ def main():
         
         # first check to see if we can end the navigation
         if local_start == global_end:
-            picar.logger.info(f"Congrats! The car has reached the destination point of {global_end}. Distance traveled: {round(picar.distance_traveled,2)}")
+            log.info("reached_destination", location=local_start, goal=global_end, distance_traveled=picar.distance_traveled)
             picar.stop_car()
             break
         if picar.calc_euclid_dist(local_start, global_end) < 4:
-            picar.logger.info(f"Congrats! The car has reached {local_start}, pretty close to its destination point of {global_end}. Distance traveled: {round(picar.distance_traveled,2)}")
+            log.info("reached_near_destination", location=local_start, goal=global_end, distance_traveled=picar.distance_traveled)
             break
         if path is not None and len(path) == 1:
-            picar.logger.info(f"Congrats! The car reached the end of the path, it's current location is {local_start} versus the goal of {global_end}. Distance traveled: {round(picar.distance_traveled,2)}")
+            log.info("reached_end_of_path", location=local_start, goal=global_end, distance_traveled=picar.distance_traveled)
             picar.stop_car()
             break
         
         # clear the map so the car doesn't get confused by previous object readings
-        global_map.maze.fill(0)
-        picar.logger.info(f"Cleared the global map. Number of marked objects now: {global_map.maze.sum()}")
+        global_map.clear()
+        log.info("cleared_map")
         
         
         # while the car is stopped, scan the surroundings for obstacles
@@ -64,7 +95,7 @@ def main():
         
         # get the coorindates "behind" the car so we don't mark objects that are behind
             # the car on the map, causing issues
-        picar.logger.info("Computing coordinates behind the car...")
+        log.debug("computing_coordinates_behind")
         coordinates_behind = picar.get_coordinates_behind(arr = global_map, position = local_start,
             angle = Direction[picar.direction].value, area_dim = (100,100),
             x_lower=x_lower, x_upper=x_upper,
@@ -79,11 +110,19 @@ def main():
             is_in_map = picar.is_point_in_map(curr_point, x_lower=x_lower, x_upper=x_upper, y_lower=y_lower, y_upper=y_upper)
             if is_in_map and curr_point not in coordinates_behind:
                 scan_points.append(curr_point)
+
+        # put the cones the camera sees on the map as well, so the planner goes around
+        # them in this pass instead of waiting for the ultrasonic sensor to find them
+        detections = detector.cache.latest(max_age=DETECTION_MAX_AGE)
+        for curr_point in fusion.detection_cells(detections, picar, camera, scan=scan):
+            is_in_map = picar.is_point_in_map(curr_point, x_lower=x_lower, x_upper=x_upper, y_lower=y_lower, y_upper=y_upper)
+            if is_in_map and curr_point not in coordinates_behind and curr_point not in scan_points:
+                scan_points.append(curr_point)
         
         # bring in the image recognition
         # here check to see for any traffic lights or stop signs to be made aware of
 
-        image_rec = detect.start(picar)
+        image_rec = detect.label_for(detector.cache.latest(max_age=DETECTION_MAX_AGE))
 
         # if the car detects any objects, then navigate to a "clearance point"
         # the "clearance point" is defined as follows:
@@ -95,7 +134,8 @@ def main():
             # sort the points so the interpolation is easier
             scan_points = sorted(scan_points)
         
-            picar.logger.info(f"Current location: {picar.current_loc}. Objects detected at: {scan_points}")
+            log.info("objects_detected", location=picar.current_loc, count=len(scan_points))
+            log.debug("object_points", points=lambda: scan_points)
             
             # interpolation of the scanned points
             scan_points_lerp = []
@@ -115,56 +155,45 @@ def main():
             # dedup points and sort
             scan_points_lerp = sorted(list(set(scan_points_lerp)))
 
-            picar.logger.info(f"Current location: {picar.current_loc}. Object points interpolated: {scan_points_lerp}")
+            log.debug("object_points_interpolated", count=len(scan_points_lerp), points=lambda: scan_points_lerp)
 
             # mark the objects on the map
             for point in scan_points_lerp:
                 global_map.mark_object(coord1=point, x_lower=x_lower, x_upper=x_upper, y_lower=y_lower, y_upper=y_upper)
         
-            # mark points in either direction direction along the a-xis so the car
-            # has room to move around the object, otherwise the A* algo will just
-            # alter the path slightly. e.g. from (1,2) to (2,2), but (2,2) is also blocked.
-            all_buff_points = []
-            if len(scan_points_lerp) > 0:
-                radius = 2
-                # mark buffers around the points
-                for point in scan_points_lerp:
-                    buff_points = picar.within_radius(point, radius)
-                    for buff_point in buff_points:
-                        if buff_point != local_start and buff_point not in coordinates_behind:
-                            global_map.mark_object(coord1=buff_point, x_lower=x_lower, x_upper=x_upper, y_lower=y_lower, y_upper=y_upper)
-                            # for logging purposes, make sure the point was actually marked
-                            if global_map[buff_point.x,buff_point.y] == 1:
-                                all_buff_points.append(buff_point)
-
-            all_buff_points = sorted(list(set(all_buff_points)))
-        
-            # mark car's location (to be removed soon)
-            global_map.maze[picar.current_loc.x,picar.current_loc.y] = 4
-
-            picar.logger.info(f"The following buffer points were marked: {all_buff_points}")
-
-            picar.logger.info(f"Total obstacles now marked on the map: {np.sum(global_map.maze[global_map.maze==1])}")
-            picar.logger.info(f"Current map around car: \n \
-                    {global_map.maze[picar.current_loc.x-5:picar.current_loc.x+6, picar.current_loc.y-5:picar.current_loc.y+6]}")    
+            # the room the car needs around the objects comes from the inflation layer,
+            # which the planner recomputes once from the updated map
 
-            # mark the car's location back to 0
-            global_map.maze[picar.current_loc.x,picar.current_loc.y] = 0
+            # counting the map and printing the slice only happen when DEBUG is on,
+            # the car's location shows up as a 4
+            log.debug("map", obstacles=lambda: int(np.count_nonzero(global_map.maze == 1)),
+                      around_car=lambda: "\n" + global_map.around(picar.current_loc))
         
             # first get the map subset where the cluster of ones should be (i.e. in front of the car
             # all the way to the global end)
             object_coordinates = []
             object_coordinates.extend(scan_points_lerp)
-            object_coordinates.extend(all_buff_points)
             # find the farthest object coordinate
             farthest_obj_point = picar.find_farthest_point(local_start, object_coordinates)
             
-            picar.logger.info(f"The farthest object point is: {farthest_obj_point}. Once passing that point, the car will stop and scan for objects again.")
+            log.info("farthest_object_point", point=farthest_obj_point)
         
-            # recompute the path with A* now that obstacles are marked
-            picar.logger.info("Attempting to recompute new A* path...")
-            path = astar(array = global_map, start=local_start, end=global_end)
-            picar.logger.info(f"Recomputed path with A*: {path}")
+            # recompute the path now that obstacles are marked
+            path = planner.find_path(local_start, global_end)
+            if path is None:
+                log.info("inside_inflation", location=local_start)
+                path = fallback_planner.find_path(local_start, global_end)
+            log.info("path_recomputed", length=len(path) if path else 0, inflation_updates=inflation.updates)
+            log.debug("path", path=lambda: path)
+            if path is None:
+                no_path_scans += 1
+                log.info("no_path", location=local_start, goal=global_end, scans=no_path_scans)
+                picar.stop_car()
+                if no_path_scans >= MAX_NO_PATH_SCANS:
+                    break
+                # the map is cleared and rebuilt from a fresh scan on the next cycle
+                continue
+            no_path_scans = 0
             
             # navigate the car around the object to the clearance point with the A* path
             prev_step = None
@@ -178,17 +207,17 @@ def main():
                 # if car has passed farthest object, exit the path loop early so the car can scan again
                 has_passed_object = picar.has_passed_object(start=local_start, end=global_end, object_pos=farthest_obj_point, buffer_dist=6)
                 if has_passed_object:
-                    picar.logger.info(f"Car has passed farthest object point of {farthest_obj_point}. Stopping to scan again.")
+                    log.info("passed_farthest_object", point=farthest_obj_point)
                     break
                 
                 # calculate turn angle adjusting for the car's current direction
                 angle_btwn_points = picar.calc_angle_btwn(prev_step, curr_step)
-                picar.logger.info(f"The angle between the points at 0 degree direction: {round(angle_btwn_points,2)}. Car's current angle direction: {round(Direction[picar.direction].value,2)}.")
+                log.debug("step_angle", angle=angle_btwn_points, car_angle=Direction[picar.direction].value)
                 # the get_turn_data() function will adjust for the car's direction and get the angle to turn
                 # in the nearest 45 degree increment
                 turn_data = picar.get_turn_data(angle_btwn_points)
                 
-                picar.logger.info(f"The car is turning {turn_data.get('angle')} degrees.")
+                log.debug("turn", angle=turn_data.get('angle'))
                 # turn the car if needed to face the global destination
                 if turn_data.get("turn_direction") == "left":
                     picar.turn_left(turn_data.get("seconds"),turn_data.get("angle"))
@@ -204,33 +233,28 @@ def main():
         # if there are no objects to be mapped, then continue onward to the global end
         # while continuing to scan for objects in order to avoid (not mapping)
         else:
-            # if an image was recognized from one of the five classes give it a time to sleep to obey traffic
+            # if an image was recognized from one of the five classes, hold until the traffic rules let the car go
             if image_rec:
-                picar.logger.info(f"The following has been recognized: {image_rec}")
-                if image_rec == 'redlight':
-                    picar.stop_car()
-                    time.sleep(5)
-                elif image_rec == 'stopsign':
-                    picar.stop_car()
-                    time.sleep(2)
-                elif image_rec == 'cone':
+                log.info("recognized", category=image_rec)
+                if picar.traffic_hold():
                     picar.stop_car()
-                    time.sleep(1)
+                    picar.wait_for_traffic()
             
-            # mark car's location (to be removed soon)
-            global_map.maze[picar.current_loc.x,picar.current_loc.y] = 4
-
-            picar.logger.info(f"Total obstacles now marked on the map: {np.sum(global_map.maze[global_map.maze==1])}")
-            picar.logger.info(f"Current map around car: \n \
-                    {global_map.maze[picar.current_loc.x-5:picar.current_loc.x+6, picar.current_loc.y-5:picar.current_loc.y+6]}")    
-
-            # mark the car's location back to 0
-            global_map.maze[picar.current_loc.x,picar.current_loc.y] = 0
+            # counting the map and printing the slice only happen when DEBUG is on,
+            # the car's location shows up as a 4
+            log.debug("map", obstacles=lambda: int(np.count_nonzero(global_map.maze == 1)),
+                      around_car=lambda: "\n" + global_map.around(picar.current_loc))
             
-            # recompute the path with A* with no obstacles marked
-            picar.logger.info("Attempting to recompute new A* path.")
-            path = astar(array = global_map, start=local_start, end=global_end)
-            picar.logger.info(f"Recomputed path with A*: {path}")
+            # recompute the path with no obstacles marked
+            path = planner.find_path(local_start, global_end)
+            log.info("path_recomputed", length=len(path) if path else 0)
+            log.debug("path", path=lambda: path)
+            if path is None:
+                # nothing is marked, so only a goal outside the map gets here
+                log.info("no_path", location=local_start, goal=global_end)
+                picar.stop_car()
+                break
+            no_path_scans = 0
             
             # figure out the farthest next point (local_end) after the local_start the car does not have to make a turn
             local_end = global_end
@@ -245,14 +269,14 @@ def main():
                     local_end = step
                     break
         
-            picar.logger.info(f"The farthest point without turning more than 45 dgrees is: {local_end}")
+            log.info("farthest_straight_point", point=local_end)
             
-            picar.logger.info(f"The angle between the points at 0 degree direction: {round(angle_btwn_points,2)}. Car's current angle direction: {round(Direction[picar.direction].value,2)}.")
+            log.debug("step_angle", angle=angle_btwn_points, car_angle=Direction[picar.direction].value)
             # the get_turn_data() function will adjust for the car's direction and get the angle to turn
             # in the nearest 45 degree increment
             turn_data = picar.get_turn_data(angle_btwn_points)
             
-            picar.logger.info(f"The car is turning {turn_data.get('angle')} degrees.")
+            log.debug("turn", angle=turn_data.get('angle'))
             # turn the car if needed to face the global destination
             if turn_data.get("turn_direction") == "left":
                 picar.turn_left(turn_data.get("seconds"),turn_data.get("angle"))
@@ -270,12 +294,16 @@ if __name__ == "__main__":
 
     try:
         main()
+    except recorder.ReplayFinished as e:
+        # PICAR_REPLAY runs end when the recording does
+        print(f"Replay finished: {e}")
     except Exception as e:
         print(f"Encountered the following exception in the main program: {e}")
         fc.stop()
-    
-    
-    
-    
-    
-    
+    finally:
+        detect.get_service().close()
+        # keep the high-rate sensor and motor records for offline analysis
+        get_navlog().sink.dump("navlog.bin")
+        # run with PICAR_TRACE=1, then open trace.json in chrome://tracing or ui.perfetto.dev
+        if trace.is_enabled():
+            trace.export_chrome("trace.json")
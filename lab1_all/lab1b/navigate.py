@@ -4,12 +4,14 @@ Picar navigation and mapping of surrounding area.
 """
 
 import picar_4wd as fc
+from picar_4wd import trace
 import numpy as np
 import logging
 import math
 import time
 from typing import List, Tuple, Union
 from helper_classes import Coordinate, Direction, Maze
+from navlog import get_navlog
     
 
 class PiCar(object):
@@ -21,6 +23,8 @@ class PiCar(object):
         direction: str = Direction.north.name,
         angle_range: int = 140,
         threshold: int = 15, # object avoidance clearance in cm
+        control_hz: int = 25, # rate of the move_forward control loop
+        max_traffic_wait: float = 10.0, # longest the car holds for one sign or light, in seconds
         car_width_cm: int = 25,
         us_offset: int = 8 # offset for ultasonic distance readings in cm, the larger the more buffer
     ) -> None:
@@ -41,10 +45,17 @@ class PiCar(object):
         self.car_width_cm = car_width_cm
         self.avoid_obstacle_time = None
         self.us_offset = us_offset
+        self.control_hz = control_hz
+        self.max_traffic_wait = max_traffic_wait
+        # optional callable polled while driving, returns True while the car has to hold
+        # for a traffic sign or light
+        self.traffic_hold = None
         self.logger = logging.getLogger()
         logging.basicConfig(format='%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
                 datefmt='%Y-%m-%d:%H:%M:%S',
                 level=logging.DEBUG)
+        # structured events, plus a binary ring buffer for the per-iteration ones
+        self.log = get_navlog()
         fc.servo.set_angle(self.current_angle)
 
     
@@ -136,6 +147,7 @@ class PiCar(object):
 
    
     # scan the area in front of the car for obstacle avoidance purposes
+    @trace.traced("picar.scan_sweep_avoid")
     def scan_sweep_avoid(self):
         self.current_angle += self.step
         if self.current_angle >= self.max_angle:
@@ -147,7 +159,8 @@ class PiCar(object):
 
         fc.servo.set_angle(self.current_angle)
         self.distance_to_obj = fc.us.get_distance() - self.us_offset
-        time.sleep(0.02)
+        self.log.record("us_avoid", self.distance_to_obj, self.current_angle)
+        # no sleep here, the caller's control loop paces the servo steps
 
     # is the point within the boundaries of the map
     # note this only works when the car is stationary and knows its current location
@@ -162,6 +175,7 @@ class PiCar(object):
     # scan the area in front of the car for mapping purposes
     # you can set a max distance (cm) for which the scan will return (distance, angle)
     # since the ultrasonic sensor can be unreliable from too far
+    @trace.traced("picar.scan_sweep_map")
     def scan_sweep_map(self, max_dist: int=50) -> Union[List[Tuple[float, int]], None]:
         scan_result = []
         # ensure the sensor gets readings going in both directions depending upon
@@ -180,6 +194,7 @@ class PiCar(object):
             self.current_angle = angle
             time.sleep(0.04)
             distance_to_obj = fc.us.get_distance() - self.us_offset
+            self.log.record("us_map", distance_to_obj, angle)
             if distance_to_obj > -2 and distance_to_obj <= max_dist:
                 scan_result.append((distance_to_obj, angle))
         # returns a list of tuples (distance cm, angle degrees)
@@ -299,31 +314,65 @@ class PiCar(object):
     
     def avoid_object(self):
         object_coord = self.get_cartesian(self.current_angle, self.distance_to_obj)
-        self.logger.info(f"Object {round(self.distance_to_obj,2)}cm away at an angle of {self.current_angle} degrees at point {object_coord}, within threshold of {self.threshold}cm. Stopping.")
+        self.log.info("object_in_threshold", distance=self.distance_to_obj, angle=self.current_angle, point=object_coord, threshold=self.threshold)
         fc.stop()
 
     # scan is a boolean value that denotes whether to scan for objects while moving
+    @trace.traced("picar.move_forward")
     def move_forward(self, distance: float, seconds: float, scan: bool):
-        self.logger.info(f"Moving FORWARD at {self.power} power for {round(seconds,2)}sec for a distance of {round(distance,2)}cm")
+        self.log.info("moving_forward", power=self.power, seconds=seconds, distance=distance)
         # move the car forwards for a number of seconds
         start_time = curr_time = time.time()
         stop_time = start_time + seconds
         # while the car is moving forward for the given number of seconds, scan the surroundings for object detection
         # and if an object is found via self.scan_sweep_avoid(), a -999 return value results, so avoid object and break the loop..
+        # time spent holding for traffic does not count towards the distance
+        paused = 0
+        # when the current traffic hold started, None while driving
+        held_at = None
+        hold_timed_out = False
+        # one control step per tick so reaction time doesn't depend on I2C latency
+        loop = fc.RateLoop(self.control_hz, "move_forward")
         while curr_time < stop_time:
+            # a traffic hold is a state of the loop, the car stays stopped and the
+            # rules are polled once per tick until they clear or max_traffic_wait runs out
+            if self.traffic_hold is not None and self.traffic_hold():
+                if held_at is None:
+                    held_at = curr_time
+                    fc.stop()
+                    self.log.info("traffic_hold")
+                if curr_time - held_at < self.max_traffic_wait:
+                    loop.sleep()
+                    now = time.time()
+                    paused += now - curr_time
+                    stop_time += now - curr_time
+                    curr_time = now
+                    continue
+                if not hold_timed_out:
+                    # e.g. the detector stopped and the last red light is still cached
+                    hold_timed_out = True
+                    self.log.info("traffic_hold_timeout", held=curr_time - held_at)
+            elif held_at is not None:
+                if not hold_timed_out:
+                    self.log.info("traffic_cleared", held=curr_time - held_at)
+                held_at = None
+                hold_timed_out = False
             fc.forward(self.power)
+            self.log.record("forward", curr_time - start_time, self.power)
             if scan:
                 self.scan_sweep_avoid()
                 if self.distance_to_obj > 0 and self.distance_to_obj <= self.threshold:
                     self.avoid_object()
                     curr_time = time.time()
                     # need a new distance since the car didn't travel the whole original distance
-                    move_time = curr_time - start_time
+                    move_time = curr_time - start_time - paused
                     distance = (move_time/seconds)*distance
-                    self.logger.info(f"Stopped early due to object detection, traveled {round(distance,2)}cm in {round(move_time,2)}sec.")
+                    self.log.info("stopped_early", distance=distance, seconds=move_time)
                     break
+            loop.sleep()
             curr_time = time.time()
         fc.stop()
+        self.log.debug("control_loop", **loop.stats())
 
         # save the current location
         prev_loc = Coordinate(self.current_loc.x, self.current_loc.y)
@@ -332,13 +381,13 @@ class PiCar(object):
         # the y-axis. also multiply by -1 since going along the positive a-axis is "east" and that is -90 degree direction
         self.current_loc.x = prev_loc.x + math.floor(distance*math.sin(math.radians(Direction[self.direction].value)))*-1
         self.current_loc.y = prev_loc.y + math.floor(distance*math.cos(math.radians(Direction[self.direction].value)))
-        self.logger.info(f"After moving forward, new location: {self.current_loc}, previous location: {prev_loc}")
+        self.log.info("moved_forward", location=self.current_loc, previous=prev_loc)
 
         # keep track of the distance traveled
         self.distance_traveled += distance
 
     def turn_left(self, seconds: float, turn_angle: float):
-        self.logger.info(f"Turning LEFT for {seconds} seconds at an angle of {turn_angle}")
+        self.log.info("turning", direction="left", seconds=seconds, angle=turn_angle)
         fc.turn_left(30)
         time.sleep(seconds)
         # update the car's absolute direction
@@ -348,7 +397,7 @@ class PiCar(object):
             new_direction_angle = new_direction_angle + 360
         elif new_direction_angle >= 180:
             new_direction_angle = new_direction_angle - 360
-        self.logger.info(f"After turning LEFT, new direction angle: {new_direction_angle}, previous direction angle: {prev_direction_angle}")
+        self.log.info("turned", direction="left", angle=new_direction_angle, previous=prev_direction_angle)
         try:
             self.direction = Direction(new_direction_angle).name
         except:
@@ -357,7 +406,7 @@ class PiCar(object):
                                 and turn angle: {turn_angle}. Angle changes should be in increments of 45 degrees.")
             
     def turn_right(self, seconds: float, turn_angle: float):
-        self.logger.info(f"Turning RIGHT for {seconds} seconds at an angle of {turn_angle}")
+        self.log.info("turning", direction="right", seconds=seconds, angle=turn_angle)
         fc.turn_right(30)
         time.sleep(seconds)
         # update the car's absolute direction
@@ -367,7 +416,7 @@ class PiCar(object):
             new_direction_angle = new_direction_angle + 360
         elif new_direction_angle >= 180:
             new_direction_angle = new_direction_angle - 360
-        self.logger.info(f"After turning RIGHT, new direction angle: {new_direction_angle}, previous direction angle: {prev_direction_angle}")
+        self.log.info("turned", direction="right", angle=new_direction_angle, previous=prev_direction_angle)
         try:
             self.direction = Direction(new_direction_angle).name
         except:
@@ -377,6 +426,21 @@ class PiCar(object):
     
     def stop_car(self):
         fc.stop()
+
+    # poll the traffic rules once per control tick until they let the car go. gives up
+    # after max_wait seconds (max_traffic_wait by default) so a detector that stopped
+    # updating can't hold the car forever, returns False when it gave up
+    def wait_for_traffic(self, max_wait: float = None) -> bool:
+        if max_wait is None:
+            max_wait = self.max_traffic_wait
+        deadline = time.monotonic() + max_wait
+        loop = fc.RateLoop(self.control_hz, "traffic_hold")
+        while self.traffic_hold is not None and self.traffic_hold():
+            if time.monotonic() >= deadline:
+                self.log.info("traffic_hold_timeout", held=max_wait)
+                return False
+            loop.sleep()
+        return True
     
     # given a location and object coordiantes, find the "farthest" object coordindate
     # from the given location
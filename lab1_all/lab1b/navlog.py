@@ -0,0 +1,140 @@
+import json
+import logging
+import struct
+import threading
+import time
+from typing import Iterator, Tuple
+
+
+class _Fields(object):
+    # formatted only if a handler actually emits the record, callables are
+    # resolved at that point too, so expensive values cost nothing when the
+    # level is off
+    __slots__ = ('name', 'fields')
+
+    def __init__(self, name: str, fields: dict) -> None:
+        self.name = name
+        self.fields = fields
+
+    def __str__(self) -> str:
+        parts = [self.name]
+        for key, value in self.fields.items():
+            if callable(value):
+                value = value()
+            if isinstance(value, float):
+                value = round(value, 2)
+            parts.append(f"{key}={value}")
+        return " ".join(parts)
+
+
+class RingBufferSink(object):
+    """Fixed-size binary log for high-rate events.
+
+    Each record is packed into a preallocated buffer as
+    (time ns, event code, a, b, c), overwriting the oldest once it is
+    full. Writing one costs a struct.pack_into and no allocation. dump()
+    saves the records in order along with the code names.
+    """
+    RECORD = struct.Struct("<qHddd")
+
+    def __init__(self, capacity: int = 65536) -> None:
+        self.capacity = capacity
+        self.buffer = bytearray(self.RECORD.size * capacity)
+        self.count = 0
+        self.codes = {}
+        self._lock = threading.Lock()
+
+    def code(self, name: str) -> int:
+        code = self.codes.get(name)
+        if code is None:
+            with self._lock:
+                code = self.codes.setdefault(name, len(self.codes))
+        return code
+
+    def record(self, name: str, a: float = 0.0, b: float = 0.0, c: float = 0.0) -> None:
+        code = self.codes.get(name)
+        if code is None:
+            code = self.code(name)
+        with self._lock:
+            offset = (self.count % self.capacity) * self.RECORD.size
+            self.RECORD.pack_into(self.buffer, offset, time.monotonic_ns(), code, a, b, c)
+            self.count += 1
+
+    def records(self) -> Iterator[Tuple[int, str, float, float, float]]:
+        names = {code: name for name, code in self.codes.items()}
+        with self._lock:
+            start = max(0, self.count - self.capacity)
+            data = bytes(self.buffer)
+            count = self.count
+        for i in range(start, count):
+            t, code, a, b, c = self.RECORD.unpack_from(data, (i % self.capacity) * self.RECORD.size)
+            yield t, names.get(code, str(code)), a, b, c
+
+    def dump(self, path: str) -> None:
+        # path gets the packed records, path + '.json' the code names
+        with open(path, 'wb') as f:
+            for t, name, a, b, c in self.records():
+                f.write(self.RECORD.pack(t, self.codes[name], a, b, c))
+        with open(path + '.json', 'w') as f:
+            json.dump(self.codes, f)
+
+    @classmethod
+    def load(cls, path: str) -> Iterator[Tuple[int, str, float, float, float]]:
+        with open(path + '.json') as f:
+            names = {code: name for name, code in json.load(f).items()}
+        with open(path, 'rb') as f:
+            data = f.read()
+        for t, code, a, b, c in cls.RECORD.iter_unpack(data):
+            yield t, names.get(code, str(code)), a, b, c
+
+
+class NavLog(object):
+    """Structured logging for the navigation loop.
+
+        log.info("moving_forward", power=10, seconds=1.5)
+        log.debug("path", path=lambda: path)          # only built if DEBUG is on
+        log.info("scan", sample=10, points=len(pts))  # one call in 10 is logged
+        log.record("us", distance, angle)             # binary ring buffer, always on
+
+    Messages come out as "name key=value ...". Nothing is formatted unless
+    the logger's level lets the record through.
+    """
+
+    def __init__(self, logger: logging.Logger = None, sink: RingBufferSink = None) -> None:
+        self.logger = logger if logger is not None else logging.getLogger()
+        self.sink = sink
+        self._counts = {}
+
+    def event(self, name: str, level: int = logging.INFO, sample: int = 1, **fields) -> None:
+        self._log(level, name, sample, fields)
+
+    def debug(self, name: str, sample: int = 1, **fields) -> None:
+        self._log(logging.DEBUG, name, sample, fields)
+
+    def info(self, name: str, sample: int = 1, **fields) -> None:
+        self._log(logging.INFO, name, sample, fields)
+
+    def record(self, name: str, a: float = 0.0, b: float = 0.0, c: float = 0.0) -> None:
+        if self.sink is not None:
+            self.sink.record(name, a, b, c)
+
+    def _log(self, level: int, name: str, sample: int, fields: dict) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        if sample > 1:
+            count = self._counts.get(name, 0)
+            self._counts[name] = count + 1
+            if count % sample:
+                return
+        # stacklevel points the [file:line] in the log format at our caller
+        self.logger.log(level, "%s", _Fields(name, fields), stacklevel=3)
+
+
+_navlog = None
+
+def get_navlog() -> NavLog:
+    """Return the shared NavLog, writing to the root logger and a 64k record ring buffer."""
+    global _navlog
+    if _navlog is None:
+        _navlog = NavLog(logging.getLogger(), RingBufferSink())
+    return _navlog
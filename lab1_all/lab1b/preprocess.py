@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+from typing import Tuple, Union
+
+
+class Preprocessor:
+    """Turns camera frames into detector input without per-frame allocations.
+
+    The flip, crop and BGR->RGB conversion write into buffers allocated
+    once for the frame size. A downscaled grayscale copy of the region of
+    interest is compared with the frame inference last ran on. When the
+    mean absolute difference is below diff_threshold, the scene is static
+    and process() returns None so the caller can reuse its last result.
+    At least every max_skip frames it runs anyway, so a slow change
+    can't hide forever.
+    """
+
+    def __init__(
+        self,
+        width: int = 320,
+        height: int = 240,
+        roi: Tuple[int, int, int, int] = None, # (x, y, width, height) of the flipped frame to run on, None for all of it
+        diff_threshold: float = 4.0, # mean gray level change (0-255) that counts as motion, 0 disables gating
+        diff_scale: int = 4, # downscale factor for the motion check
+        max_skip: int = 15
+    ) -> None:
+        self.width = width
+        self.height = height
+        if roi is None:
+            roi = (0, 0, width, height)
+        x, y, w, h = roi
+        if x < 0 or y < 0 or x + w > width or y + h > height:
+            raise ValueError(f"roi {roi} does not fit in a {width}x{height} frame")
+        self.roi = roi
+        self.diff_threshold = diff_threshold
+        self.max_skip = max_skip
+        self.frames = 0
+        self.skipped = 0
+        self._skipped_in_row = 0
+
+        self.flipped = np.empty((height, width, 3), dtype=np.uint8)
+        self.rgb = np.empty((h, w, 3), dtype=np.uint8)
+        small = (max(1, w // diff_scale), max(1, h // diff_scale))
+        self._small = np.empty((small[1], small[0], 3), dtype=np.uint8)
+        self._gray = np.empty((small[1], small[0]), dtype=np.uint8)
+        self._prev_gray = None
+        self._diff = np.empty_like(self._gray)
+
+    @property
+    def offset(self) -> Tuple[int, int]:
+        """Add this to boxes found in the ROI to get flipped-frame coordinates."""
+        return self.roi[0], self.roi[1]
+
+    def crop(self, image: np.ndarray) -> np.ndarray:
+        """Flip image into the reusable buffer and return a view of the ROI (BGR)."""
+        if image.shape[:2] != (self.height, self.width):
+            raise ValueError(f"expected a {self.width}x{self.height} frame, got {image.shape[1]}x{image.shape[0]}")
+        cv2.flip(image, 1, dst=self.flipped)
+        x, y, w, h = self.roi
+        return self.flipped[y:y + h, x:x + w]
+
+    def is_static(self, roi: np.ndarray) -> bool:
+        if self.diff_threshold <= 0:
+            return False
+        cv2.resize(roi, (self._gray.shape[1], self._gray.shape[0]), dst=self._small, interpolation=cv2.INTER_AREA)
+        if self._prev_gray is None:
+            self._prev_gray = np.empty_like(self._gray)
+            cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._prev_gray)
+            return False
+        cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        cv2.absdiff(self._gray, self._prev_gray, dst=self._diff)
+        # compare against the frame inference last ran on, so a slow drift adds
+        # up until it crosses the threshold
+        changed = cv2.mean(self._diff)[0] >= self.diff_threshold
+        if changed or self._skipped_in_row >= self.max_skip:
+            self._gray, self._prev_gray = self._prev_gray, self._gray
+            return False
+        return True
+
+    def process(self, image: np.ndarray) -> Union[Tuple[np.ndarray, np.ndarray], None]:
+        """Return (rgb, bgr) views of the ROI ready for the detector, or None if the scene is static.
+
+        Both arrays are reused by the next call, copy them to keep them.
+        """
+        self.frames += 1
+        roi = self.crop(image)
+        if self.is_static(roi):
+            self.skipped += 1
+            self._skipped_in_row += 1
+            return None
+        self._skipped_in_row = 0
+        # Convert the image from BGR to RGB as required by the TFLite model.
+        cv2.cvtColor(roi, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        return self.rgb, roi
@@ -0,0 +1,100 @@
+import time
+from typing import Dict, Iterable
+
+
+class TrafficRules(object):
+    """Decides whether the car has to hold for traffic, without sleeping.
+
+    Call update() with the newest detections as often as you like. It
+    returns True while the car should stay stopped. A category only
+    counts once it has been seen in min_frames frames in a row, so one
+    bad frame can't stop the car. Holds end at a deadline or, for lights,
+    as soon as a green light shows up. Every decision is a comparison
+    against time.monotonic(), so nothing blocks.
+
+        go        -> stopsign -> stopped at sign for min_dwell -> go
+        go        -> redlight -> red until green or max_red_wait -> go
+        go        -> yellowlight -> yellow until green, red or max_yellow_wait -> go
+        go        -> cone -> hold for cone_wait -> go
+
+    After a hold ends, its category is ignored for cooldown seconds. The
+    sign or light is usually still in view when the car pulls away.
+    """
+    GO = 'go'
+    STOP_SIGN = 'stopsign'
+    RED = 'redlight'
+    YELLOW = 'yellowlight'
+    CONE = 'cone'
+
+    def __init__(
+        self,
+        min_frames: int = 2,
+        min_dwell: float = 2.0, # full stop at a stop sign
+        max_red_wait: float = 5.0, # give up on a red light that never turns green
+        max_yellow_wait: float = 2.0,
+        cone_wait: float = 1.0,
+        cooldown: float = 5.0
+    ) -> None:
+        self.min_frames = min_frames
+        self.waits = {
+            self.STOP_SIGN: min_dwell,
+            self.RED: max_red_wait,
+            self.YELLOW: max_yellow_wait,
+            self.CONE: cone_wait,
+        }
+        self.cooldown = cooldown
+        self.state = self.GO
+        self.deadline = None
+        self.streaks: Dict[str, int] = {}
+        self.ignore_until: Dict[str, float] = {}
+        self._last_frame = None
+
+    def seen(self, category: str) -> bool:
+        return self.streaks.get(category, 0) >= self.min_frames
+
+    def update(self, detections: Iterable, now: float = None) -> bool:
+        """Feed the newest detections, returns True while the car must hold."""
+        if now is None:
+            now = time.monotonic()
+        detections = list(detections)
+        # only count each camera frame once, however often we are polled
+        frame = detections[0].timestamp if detections else None
+        if frame is None or frame != self._last_frame:
+            self._last_frame = frame
+            categories = {det.category for det in detections}
+            for category in set(self.streaks) | categories:
+                self.streaks[category] = self.streaks.get(category, 0) + 1 if category in categories else 0
+
+        if self.state == self.GO:
+            for category in (self.RED, self.STOP_SIGN, self.YELLOW, self.CONE):
+                if self.seen(category) and now >= self.ignore_until.get(category, 0):
+                    self._enter(category, now)
+                    break
+        elif self.state in (self.RED, self.YELLOW) and self.seen('greenlight'):
+            self._leave(now)
+        elif self.state == self.YELLOW and self.seen(self.RED):
+            # the light went red, wait for green from here
+            self._enter(self.RED, now)
+        elif now >= self.deadline:
+            self._leave(now)
+        return self.state != self.GO
+
+    def remaining(self, now: float = None) -> float:
+        """Seconds until the current hold times out, 0 when not holding."""
+        if self.state == self.GO:
+            return 0
+        if now is None:
+            now = time.monotonic()
+        return max(0, self.deadline - now)
+
+    def _enter(self, state: str, now: float) -> None:
+        self.state = state
+        self.deadline = now + self.waits[state]
+
+    def _leave(self, now: float) -> None:
+        self.ignore_until[self.state] = now + self.cooldown
+        if self.state == self.RED:
+            # the yellow that preceded it belongs to the same light
+            self.ignore_until[self.YELLOW] = now + self.cooldown
+        self.state = self.GO
+        self.deadline = None
@@ -1,15 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
+import time
+_import_start = time.perf_counter()
+import threading
 from picar_4wd.pwm import PWM
 from picar_4wd.adc import ADC
 from picar_4wd.pin import Pin
 from picar_4wd.motor import Motor
+from picar_4wd import motor as motor_module
 from picar_4wd.servo import Servo
 from picar_4wd.ultrasonic import Ultrasonic 
 from picar_4wd.speed import Speed
 from picar_4wd.filedb import FileDB  
+from picar_4wd.control_loop import RateLoop
 from picar_4wd.utils import *
-import time
+# The servo submodule is bound as picar_4wd.servo by the import above and
+# would shadow the lazily created servo device below.
+del servo
+
+# Importing the package must not touch the I2C bus or GPIO, tools like
+# `picar-4wd power-read` only pay for the devices they actually use.
+IMPORT_TIME_BUDGET = 0.1 # seconds
 
 # Config File:
 config = FileDB("config")
@@ -19,43 +31,58 @@ left_rear_reverse = config.get('left_rear_reverse', default_value = False)
 right_rear_reverse = config.get('right_rear_reverse', default_value = False)    
 ultrasonic_servo_offset = int(config.get('ultrasonic_servo_offset', default_value = 0)) 
 
-# Init motors
-left_front = Motor(PWM("P13"), Pin("D4"), is_reversed=left_front_reverse) # motor 1
-right_front = Motor(PWM("P12"), Pin("D5"), is_reversed=right_front_reverse) # motor 2
-left_rear = Motor(PWM("P8"), Pin("D11"), is_reversed=left_rear_reverse) # motor 3
-right_rear = Motor(PWM("P9"), Pin("D15"), is_reversed=right_rear_reverse) # motor 4
-
-# left_front_speed = Speed(12)
-# right_front_speed = Speed(16)
-left_rear_speed = Speed(25)
-right_rear_speed = Speed(4)  
-
-# Init Greyscale
-gs0 = ADC('A5')
-gs1 = ADC('A6')
-gs2 = ADC('A7')
-
-# Init Ultrasonic
-us = Ultrasonic(Pin('D8'), Pin('D9'))
+# Devices are created on first use. They are still reachable as module
+# attributes (fc.servo, fc.us, fc.left_front, ...) through __getattr__.
+_device_factories = {
+    # Init motors
+    "left_front": lambda: Motor(PWM("P13"), Pin("D4"), is_reversed=left_front_reverse), # motor 1
+    "right_front": lambda: Motor(PWM("P12"), Pin("D5"), is_reversed=right_front_reverse), # motor 2
+    "left_rear": lambda: Motor(PWM("P8"), Pin("D11"), is_reversed=left_rear_reverse), # motor 3
+    "right_rear": lambda: Motor(PWM("P9"), Pin("D15"), is_reversed=right_rear_reverse), # motor 4
+    # "left_front_speed": lambda: Speed(12),
+    # "right_front_speed": lambda: Speed(16),
+    "left_rear_speed": lambda: Speed(25),
+    "right_rear_speed": lambda: Speed(4),
+    # Init Greyscale
+    "gs0": lambda: ADC('A5'),
+    "gs1": lambda: ADC('A6'),
+    "gs2": lambda: ADC('A7'),
+    # Init Ultrasonic
+    "us": lambda: Ultrasonic(Pin('D8'), Pin('D9')),
+    # Init Servo
+    "servo": lambda: Servo(PWM("P0"), offset=ultrasonic_servo_offset),
+}
+_devices = {}
+_devices_lock = threading.Lock()
 
-# Init Servo
-# print("Init Servo: %s" % ultrasonic_servo_offset)
+def _device(name):
+    try:
+        return _devices[name]
+    except KeyError:
+        pass
+    with _devices_lock:
+        if name not in _devices:
+            _devices[name] = _device_factories[name]()
+        return _devices[name]
 
-servo = Servo(PWM("P0"), offset=ultrasonic_servo_offset)
+def __getattr__(name):
+    if name in _device_factories:
+        return _device(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 def start_speed_thread():
-    # left_front_speed.start()
-    # right_front_speed.start()
-    left_rear_speed.start()
-    right_rear_speed.start()
+    # _device("left_front_speed").start()
+    # _device("right_front_speed").start()
+    _device("left_rear_speed").start()
+    _device("right_rear_speed").start()
 
 ##################################################################
 # Grayscale 
 def get_grayscale_list():
     adc_value_list = []
-    adc_value_list.append(gs0.read())
-    adc_value_list.append(gs1.read())
-    adc_value_list.append(gs2.read())
+    adc_value_list.append(_device("gs0").read())
+    adc_value_list.append(_device("gs1").read())
+    adc_value_list.append(_device("gs2").read())
     return adc_value_list
 
 def is_on_edge(ref, gs_list):
@@ -114,14 +141,13 @@ def do(msg="", cmd=""):
 
 def get_distance_at(angle):
     global angle_distance
-    servo.set_angle(angle)
+    _device("servo").set_angle(angle)
     time.sleep(0.04)
-    distance = us.get_distance()
+    distance = _device("us").get_distance()
     angle_distance = [angle, distance]
     return distance
 
-def get_status_at(angle, ref1=35, ref2=10):
-    dist = get_distance_at(angle)
+def _distance_status(dist, ref1=35, ref2=10):
     if dist > ref1 or dist == -2:
         return 2
     elif dist > ref2:
@@ -129,8 +155,12 @@ def get_status_at(angle, ref1=35, ref2=10):
     else:
         return 0
 
-def scan_step(ref):
-    global scan_list, current_angle, us_step
+def get_status_at(angle, ref1=35, ref2=10):
+    dist = get_distance_at(angle)
+    return _distance_status(dist, ref1, ref2)
+
+def _advance_scan_angle():
+    global current_angle, us_step
     current_angle += us_step
     if current_angle >= max_angle:
         current_angle = max_angle
@@ -138,8 +168,10 @@ def scan_step(ref):
     elif current_angle <= min_angle:
         current_angle = min_angle
         us_step = STEP
-    status = get_status_at(current_angle, ref1=ref)#ref1
+    return current_angle
 
+def _record_scan_status(status):
+    global scan_list
     scan_list.append(status)
     if current_angle == min_angle or current_angle == max_angle:
         if us_step < 0:
@@ -152,47 +184,58 @@ def scan_step(ref):
     else:
         return False
 
+def scan_step(ref):
+    angle = _advance_scan_angle()
+    status = get_status_at(angle, ref1=ref)#ref1
+    return _record_scan_status(status)
+
 ########################################################
 # Motors
-def forward(power):
-    left_front.set_power(power)
-    left_rear.set_power(power)
-    right_front.set_power(power)
-    right_rear.set_power(power)
-
-def backward(power):
-    left_front.set_power(-power)
-    left_rear.set_power(-power)
-    right_front.set_power(-power)
-    right_rear.set_power(-power)
-
-def turn_left(power):
-    left_front.set_power(-power)
-    left_rear.set_power(-power)
-    right_front.set_power(power)
-    right_rear.set_power(power)
-
-def turn_right(power):
-    left_front.set_power(power)
-    left_rear.set_power(power)
-    right_front.set_power(-power)
-    right_rear.set_power(-power)
-
-def stop():
-    left_front.set_power(0)
-    left_rear.set_power(0)
-    right_front.set_power(0)
-    right_rear.set_power(0)
+# Every drive helper takes ramp=True to slew toward the power on the motor
+# scheduler instead of jumping, it then returns a Future that completes
+# once all four motors reach their target.
+motor_scheduler = motor_module.scheduler
+
+def _drive(left_power, right_power, ramp):
+    motors = (
+        (_device("left_front"), left_power),
+        (_device("left_rear"), left_power),
+        (_device("right_front"), right_power),
+        (_device("right_rear"), right_power),
+    )
+    if ramp:
+        return motor_scheduler.set_targets(motors)
+    for motor, power in motors:
+        motor.set_power(power)
+
+def forward(power, ramp=False):
+    return _drive(power, power, ramp)
+
+def backward(power, ramp=False):
+    return _drive(-power, -power, ramp)
+
+def turn_left(power, ramp=False):
+    return _drive(-power, power, ramp)
+
+def turn_right(power, ramp=False):
+    return _drive(power, -power, ramp)
+
+def stop(ramp=False):
+    return _drive(0, 0, ramp)
 
 def set_motor_power(motor, power):
     if motor == 1:
-        left_front.set_power(power)
+        _device("left_front").set_power(power)
     elif motor == 2:
-        right_front.set_power(power)
+        _device("right_front").set_power(power)
     elif motor == 3:
-        left_rear.set_power(power)
+        _device("left_rear").set_power(power)
     elif motor == 4:
-        right_rear.set_power(power)
+        _device("right_rear").set_power(power)
+
+def set_motor_target(motor, power):
+    names = {1: "left_front", 2: "right_front", 3: "left_rear", 4: "right_rear"}
+    return _device(names[motor]).set_target(power)
 
 # def speed_val(*arg):
 #     if len(arg) == 0:
@@ -207,7 +250,91 @@ def set_motor_power(motor, power):
 #         return right_rear_speed()
 
 def speed_val():
-    return (left_rear_speed() + right_rear_speed()) / 2.0
+    return (_device("left_rear_speed")() + _device("right_rear_speed")()) / 2.0
+
+########################################################
+# Asyncio
+# Coroutines must not block the event loop on the bus, servo settling or
+# the ultrasonic busy-wait. Every hardware call from async code runs on a
+# single worker thread, which also keeps calls from interleaving.
+_hw_executor = None
+
+def hw_executor():
+    global _hw_executor
+    with _devices_lock:
+        if _hw_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _hw_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="picar-hw")
+        return _hw_executor
+
+def hw_call(func, *args):
+    """Run func(*args) on the hardware thread from a plain thread and wait."""
+    if threading.current_thread().name.startswith("picar-hw"):
+        return func(*args)
+    return hw_executor().submit(func, *args).result()
+
+async def async_call(func, *args):
+    """Run func(*args) on the hardware thread without blocking the loop."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hw_executor(), lambda: func(*args))
+
+async def async_forward(power):
+    return await async_call(forward, power)
+
+async def async_backward(power):
+    return await async_call(backward, power)
+
+async def async_turn_left(power):
+    return await async_call(turn_left, power)
+
+async def async_turn_right(power):
+    return await async_call(turn_right, power)
+
+async def async_stop():
+    return await async_call(stop)
+
+async def async_set_motor_power(motor, power):
+    return await async_call(set_motor_power, motor, power)
+
+async def async_get_grayscale_list():
+    return await async_call(get_grayscale_list)
+
+async def async_get_distance_at(angle):
+    global angle_distance
+    import asyncio
+    await async_call(lambda: _device("servo").set_angle(angle))
+    # Let the servo settle without holding the hardware thread
+    await asyncio.sleep(0.04)
+    distance = await async_call(lambda: _device("us").get_distance())
+    angle_distance = [angle, distance]
+    return distance
+
+async def async_get_status_at(angle, ref1=35, ref2=10):
+    dist = await async_get_distance_at(angle)
+    return _distance_status(dist, ref1, ref2)
+
+async def async_scan_step(ref):
+    angle = _advance_scan_angle()
+    status = await async_get_status_at(angle, ref1=ref)
+    return _record_scan_status(status)
+
+async def async_soft_reset():
+    return await async_call(soft_reset)
+
+########################################################
+# Recording and replay
+# PICAR_RECORD=run.rec records every sensor reading and motor command of the
+# process, PICAR_REPLAY=run.rec feeds the sensors from such a recording
+# instead of the hardware. PICAR_REPLAY_REALTIME=1 replays at recorded speed.
+from picar_4wd import recorder
+if os.environ.get('PICAR_REPLAY'):
+    recorder.start_replay(os.environ['PICAR_REPLAY'], realtime=os.environ.get('PICAR_REPLAY_REALTIME') == '1',
+                          loop=os.environ.get('PICAR_REPLAY_LOOP') == '1')
+if os.environ.get('PICAR_RECORD'):
+    recorder.start_recording(os.environ['PICAR_RECORD'])
+
+import_time = time.perf_counter() - _import_start
 
 ######################################################## 
 if __name__ == '__main__':
@@ -0,0 +1,76 @@
+import time
+from picar_4wd import trace
+
+class RateLoop(object):
+    """Paces a control loop at a fixed rate on the monotonic clock.
+
+    Call sleep() at the end of every iteration. It waits until the next
+    deadline (start + n * period), so the period doesn't drift with the
+    body's run time. An iteration that overruns its deadline is counted
+    as a miss. The schedule then restarts from now instead of running
+    the skipped ticks back to back. Call resync() after pausing the loop
+    on purpose so the pause isn't counted as a miss.
+
+        loop = RateLoop(25)
+        while driving:
+            fc.forward(power)
+            check_sensors()
+            loop.sleep()
+        print(loop.stats())
+    """
+
+    def __init__(self, hz, name="loop"):
+        if hz <= 0:
+            raise ValueError("hz must be positive, not %s" % hz)
+        self.hz = hz
+        self.period = 1.0 / hz
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        """Zero the counters and start the schedule over."""
+        self.iterations = 0
+        self.misses = 0
+        self.max_overrun = 0.0
+        self.busy = 0.0  # time spent in loop bodies
+        self._start = self._last = time.monotonic()
+        self._deadline = self._start + self.period
+
+    def resync(self):
+        """Start the schedule over from now, e.g. after the loop was paused on purpose.
+
+        The counters keep running, the pause is left out of the load.
+        """
+        now = time.monotonic()
+        self._start += now - self._last
+        self._last = now
+        self._deadline = now + self.period
+
+    def sleep(self):
+        """Wait for the next tick, returns False if this iteration missed its deadline."""
+        now = time.monotonic()
+        self.iterations += 1
+        self.busy += now - self._last
+        overrun = now - self._deadline
+        if overrun > 0:
+            self.misses += 1
+            self.max_overrun = max(self.max_overrun, overrun)
+            trace.instant("deadline_miss", loop=self.name, overrun_ms=overrun * 1000)
+            self._deadline = now + self.period
+            self._last = now
+            return False
+        time.sleep(self._deadline - now)
+        self._last = self._deadline
+        self._deadline += self.period
+        return True
+
+    def stats(self):
+        elapsed = time.monotonic() - self._start
+        return {
+            "hz": self.hz,
+            "iterations": self.iterations,
+            "misses": self.misses,
+            "max_overrun_ms": round(self.max_overrun * 1000, 2),
+            # fraction of the time the loop body was running, the rest was sleep
+            "load": round(self.busy / elapsed, 3) if elapsed > 0 else 0.0,
+        }
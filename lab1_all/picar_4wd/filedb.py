@@ -1,7 +1,16 @@
+import os
+import ast
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
+
 class FileDB(object):
 	"""A file based database.
 
     A file based database, read and write arguements in the specific file.
+    The file is parsed once into a dict and only re-read when its mtime
+    changes, so repeated gets do not touch the disk.
     """
 	DIR = "/home/pi/.picar-4wd/"
 	def __init__(self, db=None):
@@ -12,57 +21,142 @@ class FileDB(object):
 			self.db = db
 		else:
 			self.db = "config"
+		self._lock = threading.RLock()
+		self._lines = []		# raw lines, kept so comments survive a rewrite
+		self._index = {}		# name -> line number in self._lines
+		self._values = {}		# name -> parsed value
+		self._stamp = None		# (mtime_ns, size) of the file we parsed
+		self._dirty = False
+		self._batch_depth = 0
 
-	def get(self, name, default_value=None):
-		"""Get value by data's name. Default value is for the arguemants do not exist"""
+	@property
+	def path(self):
+		return self.DIR + self.db
+
+	def _stat(self):
 		try:
-			conf = open(self.DIR+self.db,'r')
-			lines=conf.readlines()
-			conf.close()
-			flag = False
-			# Find the arguement and set the value
-			for line in lines:
-				# print(line)
-				if line.startswith('#'):
-					continue
-				# print("no#")
-				if line.split('=')[0].strip() == name:
-					# print(name)
-					value = line.split('=')[1].replace(' ', '').strip()
-					break
-			else:
-				# print("flag_error")
-				return default_value
+			st = os.stat(self.path)
+		except OSError:
+			return None
+		return (st.st_mtime_ns, st.st_size)
 
-			return eval(value)
+	@staticmethod
+	def _parse_value(raw):
+		return ast.literal_eval(raw.replace(' ', '').strip())
 
+	def _load(self):
+		"""Re-read the file if it changed on disk since the last parse."""
+		stamp = self._stat()
+		if stamp is not None and stamp == self._stamp:
+			return
+		# Unflushed sets win over the file until they are written out
+		if self._dirty:
+			return
+		self._lines = []
+		self._index = {}
+		self._values = {}
+		self._stamp = stamp
+		if stamp is None:
+			return
+		try:
+			with open(self.path, 'r') as conf:
+				self._lines = conf.readlines()
 		except Exception as e:
 			print('error: %s'%e)
-			return default_value
-	
+			return
+		for i, line in enumerate(self._lines):
+			if line.startswith('#') or '=' not in line:
+				continue
+			name, raw = line.split('=')[:2]
+			name = name.strip()
+			if name in self._index:
+				continue
+			self._index[name] = i
+			try:
+				self._values[name] = self._parse_value(raw)
+			except Exception as e:
+				print('error: %s'%e)
+
+	def get(self, name, default_value=None):
+		"""Get value by data's name. Default value is for the arguemants do not exist"""
+		with self._lock:
+			self._load()
+			return self._values.get(name, default_value)
+
 	def set(self, name, value):
 		"""Set value by data's name. Or create one if the arguement does not exist"""
+		with self._lock:
+			self._load()
+			line = '%s = %s\n' % (name, value)
+			if name in self._index:
+				self._lines[self._index[name]] = line
+			# If arguement does not exist, create one
+			else:
+				if self._lines and not self._lines[-1].endswith('\n'):
+					self._lines[-1] += '\n'
+				self._index[name] = len(self._lines)
+				self._lines.append(line)
+				self._lines.append('\n')
+			try:
+				self._values[name] = self._parse_value(str(value))
+			except Exception:
+				self._values.pop(name, None)
+			self._dirty = True
+			if self._batch_depth == 0:
+				self.flush()
 
-		# Read the file
-		conf = open(self.DIR+self.db,'r')
-		lines=conf.readlines()
-		conf.close()
-		flag = False
-		# Find the arguement and set the value
-		for i, line in enumerate(lines):
-			if line.startswith('#'):
-				continue
-			if line.split('=')[0].strip() == name:
-				lines[i] = '%s = %s\n' % (name, value)
-				break
-		# If arguement does not exist, create one
-		else:
-			lines.append('%s = %s\n\n' % (name, value))
+	@contextmanager
+	def batch(self):
+		"""Group several set() calls into a single write of the file.
 
-		# Save the file
-		conf = open(self.DIR+self.db,'w')
-		conf.writelines(lines)
-		conf.close()
+		    with db.batch():
+		        db.set('a', 1)
+		        db.set('b', 2)
+		"""
+		with self._lock:
+			self._batch_depth += 1
+		try:
+			yield self
+		finally:
+			with self._lock:
+				self._batch_depth -= 1
+				if self._batch_depth == 0:
+					self.flush()
+
+	def flush(self):
+		"""Write pending changes atomically through a temp file and rename."""
+		with self._lock:
+			if not self._dirty:
+				return
+			fd, tmp_path = tempfile.mkstemp(dir=self.DIR, prefix='.%s.' % self.db)
+			try:
+				with os.fdopen(fd, 'w') as conf:
+					conf.writelines(self._lines)
+					conf.flush()
+					os.fsync(conf.fileno())
+				self._copy_permissions(tmp_path)
+				os.replace(tmp_path, self.path)
+			except BaseException:
+				os.unlink(tmp_path)
+				raise
+			self._dirty = False
+			self._stamp = self._stat()
+
+	def _copy_permissions(self, tmp_path):
+		# mkstemp creates the file 0600 and owned by us, keep the config's own mode
+		# and owner so a run under sudo doesn't lock the pi user out of it
+		try:
+			st = os.stat(self.path)
+		except FileNotFoundError:
+			os.chmod(tmp_path, 0o644)
+			return
+		os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+		if (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+			try:
+				os.chown(tmp_path, st.st_uid, st.st_gid)
+			except PermissionError:
+				# only root can give a file away, the mode still matches
+				pass
 
 def test():
 	name = "hhh"
@@ -72,6 +166,10 @@ def test():
 	print("Get exist: %s" % db.get(name, 0))
 	print("Set exist: %s" % db.set(name, 20))
 	print("Get exist: %s" % db.get(name, 0))
+	with db.batch():
+		db.set(name, 30)
+		db.set(name + "2", 40)
+	print("Get batched: %s %s" % (db.get(name, 0), db.get(name + "2", 0)))
 
 if __name__ == "__main__":
-	test()
\ No newline at end of file
+	test()
@@ -1,5 +1,6 @@
 from smbus import SMBus
 from picar_4wd.utils import soft_reset
+from picar_4wd import trace
 import time
 
 class I2C(object):
@@ -91,21 +92,22 @@ class I2C(object):
         else:
             raise ValueError("send data must be int, list, or bytearray, not {}".format(type(send)))
 
-        if len(data_all) == 1:                      
-            data = data_all[0]
-            self._i2c_write_byte(addr, data)
-        elif len(data_all) == 2:                    
-            reg = data_all[0]
-            data = data_all[1]
-            self._i2c_write_byte_data(addr, reg, data)
-        elif len(data_all) == 3:                    
-            reg = data_all[0]
-            data = (data_all[2] << 8) + data_all[1]
-            self._i2c_write_word_data(addr, reg, data)
-        else:
-            reg = data_all[0]
-            data = list(data_all[1:])
-            self._i2c_write_i2c_block_data(addr, reg, data)
+        with trace.span("i2c.send", addr=addr, bytes=len(data_all)):
+            if len(data_all) == 1:                      
+                data = data_all[0]
+                self._i2c_write_byte(addr, data)
+            elif len(data_all) == 2:                    
+                reg = data_all[0]
+                data = data_all[1]
+                self._i2c_write_byte_data(addr, reg, data)
+            elif len(data_all) == 3:                    
+                reg = data_all[0]
+                data = (data_all[2] << 8) + data_all[1]
+                self._i2c_write_word_data(addr, reg, data)
+            else:
+                reg = data_all[0]
+                data = list(data_all[1:])
+                self._i2c_write_i2c_block_data(addr, reg, data)
 
     def recv(self, recv, addr=0x00, timeout=0):     
         if isinstance(recv, int):                   
@@ -114,8 +116,9 @@ class I2C(object):
             result = recv
         else:
             return False
-        for i in range(len(result)):
-            result[i] = self._i2c_read_byte(addr)
+        with trace.span("i2c.recv", addr=addr, bytes=len(result)):
+            for i in range(len(result)):
+                result[i] = self._i2c_read_byte(addr)
         return result
 
     def mem_write(self, data, addr, memaddr, timeout=5000, addr_size=8): #memaddr match to chn
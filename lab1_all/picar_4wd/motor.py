@@ -1,4 +1,6 @@
 import threading
+import time
+from concurrent.futures import Future
 
 class Motor():
     STEP = 10
@@ -9,12 +11,23 @@ class Motor():
         self._is_reversed = is_reversed
         self._power = 0
         self._except_power = 0
-    
-    # def start_timer(self):
-    #     self.t = threading.Timer(self.DELAY, self.adder_thread)
-    #     self.t.start()
 
     def set_power(self, power):
+        # Jumps straight to power, dropping any ramp still in progress
+        scheduler.cancel(self)
+        self._except_power = power
+        self._set_power(power)
+
+    def set_target(self, power):
+        """Ramp toward power without blocking.
+
+        Returns a Future that completes once the motor reaches power, or is
+        cancelled when another target or set_power() supersedes it.
+        """
+        return scheduler.set_target(self, power)
+
+    def _set_power(self, power):
+        self._power = power
         if power >= 0:
             direction = 0
         elif power < 0:
@@ -29,24 +42,112 @@ class Motor():
             
         self.pwm_pin.pulse_width_percent(power)
 
-#     def adder_thread(self):
-#         if self._except_power > self._power:
-#             step = self.STEP
-#         else:
-#             step = -self.STEP
-#         if abs(self._except_power - self._power) < self.STEP:
-#             self._power = self._except_power
-#         else:
-#             self._power += step
-#         self._set_power(self._power)
-#         if self._power != self._except_power:
-#             self.start_timer()
-
-#     def set_power(self, power):
-#         # print("Power: {}".format(power))
-#         self._except_power = power
-#         if self._power != self._except_power:
-#             self.start_timer()
+
+class MotorScheduler():
+    """Ramps every motor toward its target power from one background thread.
+
+    The thread wakes on a fixed tick and moves each motor at most
+    slew_rate * tick power units, so no timer is spawned per step. It
+    sleeps on a condition while no motor is ramping.
+    """
+    TICK = 0.02
+
+    def __init__(self, slew_rate=Motor.STEP / Motor.DELAY, tick=TICK):
+        self.slew_rate = slew_rate # power per second
+        self.tick = tick
+        self._targets = {} # motor -> [target, future]
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def set_target(self, motor, power):
+        future = Future()
+        with self._cond:
+            self._cancel(motor)
+            motor._except_power = power
+            if motor._power == power:
+                future.set_result(power)
+                return future
+            self._targets[motor] = [power, future]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="MotorScheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def set_targets(self, motor_powers):
+        """Set several targets at once, the Future completes when all are reached."""
+        futures = [self.set_target(motor, power) for motor, power in motor_powers]
+        return gather(futures)
+
+    def cancel(self, motor):
+        with self._cond:
+            self._cancel(motor)
+
+    def _cancel(self, motor):
+        entry = self._targets.pop(motor, None)
+        if entry is not None:
+            entry[1].cancel()
+
+    def _step(self):
+        step = self.slew_rate * self.tick
+        with self._cond:
+            for motor, (target, future) in list(self._targets.items()):
+                power = motor._power
+                if abs(target - power) <= step:
+                    power = target
+                elif target > power:
+                    power += step
+                else:
+                    power -= step
+                motor._set_power(power)
+                if power == target:
+                    del self._targets[motor]
+                    future.set_result(target)
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            with self._cond:
+                while not self._targets:
+                    self._cond.wait()
+                    next_tick = time.monotonic()
+            self._step()
+            next_tick += self.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind (slow bus), don't try to catch up with a burst
+                next_tick = time.monotonic()
+
+
+def gather(futures):
+    """Return a Future that completes when every future in futures is done."""
+    result = Future()
+    futures = list(futures)
+    remaining = [len(futures)]
+    lock = threading.Lock()
+    if not futures:
+        result.set_result([])
+        return result
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] != 0:
+                return
+        if any(f.cancelled() for f in futures):
+            result.cancel()
+        else:
+            result.set_result([f.result() for f in futures])
+
+    for future in futures:
+        future.add_done_callback(done)
+    return result
+
+
+# Shared by every Motor
+scheduler = MotorScheduler()
 
 # if __name__ == "__main__":
 #     import picar-4wd as fc
@@ -1,8 +1,31 @@
 import smbus, math
+import functools
 from picar_4wd.i2c import I2C
 from picar_4wd.pin import Pin
+from picar_4wd import utils
 import time
 
+@functools.lru_cache(maxsize=None)
+def freq_config(clock, freq):
+    """Return the [prescaler, arr] pair that gets closest to freq for clock."""
+    # [prescaler,arr] list
+    result_ap = []
+    # accuracy list
+    result_acy = []
+    # middle value for equal arr prescaler
+    st = int(math.sqrt(clock/freq))
+    # get -5 value as start
+    st -= 5
+    # prevent negetive value
+    if st <= 0:
+        st = 1
+    for psc in range(st,st+10):
+        arr = int(clock/freq/psc)
+        result_ap.append((psc, arr))
+        result_acy.append(abs(freq-clock/psc/arr))
+    i = result_acy.index(min(result_acy))
+    return result_ap[i]
+
 class PWM(I2C):
     REG_CHN = 0x20
     REG_FRE = 0x30
@@ -11,6 +34,18 @@ class PWM(I2C):
     ADDR = 0x14
     CLOCK = 72000000
 
+    # Address found by the first probe, shared by every channel
+    _probed_addr = None
+    # Last value written to each timer register. Channels on the same timer
+    # share it so the timer is only reprogrammed when its config changes.
+    # The cache only knows about soft resets done by this process: call
+    # PWM.invalidate() after resetting the HAT from anywhere else. Entries
+    # also expire after TIMER_REFRESH seconds, so registers lost to a
+    # brownout or another process's reset are rewritten soon after.
+    TIMER_REFRESH = 1.0 # seconds
+    _timer_regs = {}
+    _timer_regs_reset_count = 0
+
     def __init__(self, channel):
         super().__init__()
         if isinstance(channel, str):
@@ -18,12 +53,15 @@ class PWM(I2C):
                 channel = int(channel[1:])
             else:
                 raise ValueError("PWM channel should be between [P1, P14], not {0}".format(channel))
-        try:
-            self.send(0x2C, self.ADDR)
-            self.send(0, self.ADDR)
-            self.send(0, self.ADDR)
-        except IOError:
-            self.ADDR = 0x15
+        if PWM._probed_addr is None:
+            try:
+                self.send(0x2C, self.ADDR)
+                self.send(0, self.ADDR)
+                self.send(0, self.ADDR)
+                PWM._probed_addr = self.ADDR
+            except IOError:
+                PWM._probed_addr = 0x15
+        self.ADDR = PWM._probed_addr
 
       #  self.debug = debug
       #  self._debug("PWM address: {:02X}".format(self.ADDR))
@@ -32,6 +70,8 @@ class PWM(I2C):
         self.bus = smbus.SMBus(1)
         self._pulse_width = 0
         self._freq = 50
+        # Wanted timer registers, written lazily before the next pulse width
+        self._timer_config = {}
         self.freq(50)
 
     def i2c_write(self, reg, value):
@@ -45,24 +85,7 @@ class PWM(I2C):
             return self._freq
         else:
             self._freq = int(freq[0])
-            # [prescaler,arr] list
-            result_ap = []
-            # accuracy list
-            result_acy = []
-            # middle value for equal arr prescaler
-            st = int(math.sqrt(self.CLOCK/self._freq))
-            # get -5 value as start
-            st -= 5
-            # prevent negetive value
-            if st <= 0:
-                st = 1
-            for psc in range(st,st+10):
-                arr = int(self.CLOCK/self._freq/psc)
-                result_ap.append([psc, arr])
-                result_acy.append(abs(self._freq-self.CLOCK/psc/arr))
-            i = result_acy.index(min(result_acy))
-            psc = result_ap[i][0]
-            arr = result_ap[i][1]
+            psc, arr = freq_config(self.CLOCK, self._freq)
         #   self._debug("prescaler: %s, period: %s"%(psc, arr))
             self.prescaler(psc)
             self.period(arr)
@@ -74,7 +97,7 @@ class PWM(I2C):
             self._prescaler = int(prescaler[0]) - 1
             reg = self.REG_PSC + self.timer
         #    self._debug("Set prescaler to: %s"%self._prescaler)
-            self.i2c_write(reg, self._prescaler)
+            self._timer_config[reg] = self._prescaler
 
     def period(self, *arr):
         if len(arr) == 0:
@@ -83,7 +106,25 @@ class PWM(I2C):
             self._arr = int(arr[0]) - 1
             reg = self.REG_ARR + self.timer
         #    self._debug("Set arr to: %s"%self._arr)
-            self.i2c_write(reg, self._arr)
+            self._timer_config[reg] = self._arr
+
+    @classmethod
+    def invalidate(cls):
+        """Forget the cached timer registers, the next pulse width rewrites them."""
+        cls._timer_regs.clear()
+
+    def _write_timer(self):
+        # A soft reset puts the timers back to their defaults
+        if PWM._timer_regs_reset_count != utils.soft_reset_count:
+            PWM._timer_regs.clear()
+            PWM._timer_regs_reset_count = utils.soft_reset_count
+        now = time.monotonic()
+        for reg, value in self._timer_config.items():
+            key = (self.ADDR, reg)
+            cached = PWM._timer_regs.get(key)
+            if cached is None or cached[0] != value or now - cached[1] > self.TIMER_REFRESH:
+                self.i2c_write(reg, value)
+                PWM._timer_regs[key] = (value, now)
 
     def pulse_width(self, *pulse_width):
         if len(pulse_width) == 0:
@@ -91,6 +132,7 @@ class PWM(I2C):
         else:
             self._pulse_width = int(pulse_width[0])
             reg = self.REG_CHN + self.channel
+            self._write_timer()
             # CCR = int(self._pulse_width/self.PRECISION * self._arr)
             # print("CCR: %s"%CCR)
             self.i2c_write(reg, self._pulse_width)
@@ -103,13 +145,16 @@ class PWM(I2C):
             pulse_width = self._pulse_width_percent * self._arr
             self.pulse_width(pulse_width)
 
-        
+# Precompute the config for the 50Hz every channel starts at
+freq_config(PWM.CLOCK, 50)
+
 def test():
     import time
     p = PWM('P12')
     # p.debug = 'debug'
     p.period(1000)
     p.prescaler(10)
+    print(freq_config.cache_info())
     # p.pulse_width(2048)
     while True:
         for i in range(0, 4095, 10):
@@ -0,0 +1,553 @@
+import atexit
+import bisect
+import heapq
+import mmap
+import struct
+import sys
+import threading
+import time
+from array import array
+import picar_4wd as fc
+
+# A recording is a 16 byte header followed by chunks. Every chunk holds the
+# rows of one stream column by column: an int64 column of time.monotonic_ns()
+# timestamps, then one column per field, each padded to 8 bytes. Chunks are
+# only ever appended, so a run that dies loses at most the rows still
+# buffered in memory.
+#
+#   header  MAGIC, version, byte order
+#   chunk   b"ROWS", stream id, 0, rows     then the columns
+#   chunk   b"NAME", code, 0, length        then the utf-8 name of a detection category
+MAGIC = b"PICAREC\0"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+CHUNK = struct.Struct("<4sHHQ")
+
+# stream -> (column, array typecode) after the timestamp
+STREAMS = {
+    "ultrasonic": (("angle", "d"), ("distance", "d")),
+    "grayscale": (("channel", "B"), ("value", "I")),
+    "speed": (("wheel", "B"), ("speed", "d")),
+    "motor": (("motor", "B"), ("power", "d")),
+    # category is a NAME code, -1 marks a frame without detections
+    "detection": (("category", "h"), ("score", "f"), ("x", "i"), ("y", "i"), ("w", "i"), ("h", "i")),
+}
+STREAM_IDS = {name: i for i, name in enumerate(STREAMS)}
+STREAM_NAMES = list(STREAMS)
+_BYTE_ORDERS = {"little": 0, "big": 1}
+
+# motor and wheel numbers follow set_motor_power()
+MOTOR_IDS = {"left_front": 1, "right_front": 2, "left_rear": 3, "right_rear": 4}
+WHEEL_IDS = {"left_rear_speed": 3, "right_rear_speed": 4}
+
+def _padding(size):
+    return b"\0" * (-size % 8)
+
+class ReplayFinished(Exception):
+    """Raised by a replayed sensor once the recording has no more readings for it."""
+
+class Recorder(object):
+    """Append-only writer for a recording.
+
+    Rows are buffered per stream in typed arrays and written out as one
+    chunk every chunk_rows rows, so record() is an append under a lock.
+    """
+
+    def __init__(self, path, chunk_rows=4096):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.codes = {}
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._columns = {stream: self._new_columns(stream) for stream in STREAMS}
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, _BYTE_ORDERS[sys.byteorder]))
+
+    @staticmethod
+    def _new_columns(stream):
+        return [array('q')] + [array(typecode) for _, typecode in STREAMS[stream]]
+
+    def record(self, stream, *values, t=None):
+        if t is None:
+            t = time.monotonic_ns()
+        with self._lock:
+            if self._file is None:
+                return
+            columns = self._columns[stream]
+            columns[0].append(t)
+            for column, value in zip(columns[1:], values):
+                column.append(value)
+            self.rows += 1
+            if len(columns[0]) >= self.chunk_rows:
+                self._flush(stream)
+
+    def code(self, name):
+        """Number for a detection category, its NAME chunk is written on first use."""
+        code = self.codes.get(name)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(name)
+                if code is None:
+                    code = self.codes[name] = len(self.codes)
+                    data = name.encode()
+                    if self._file is not None:
+                        self._file.write(CHUNK.pack(b"NAME", code, 0, len(data)) + data + _padding(len(data)))
+        return code
+
+    def record_detections(self, detections, timestamp):
+        t = int(timestamp * 1e9)
+        if not detections:
+            self.record("detection", -1, 0.0, 0, 0, 0, 0, t=t)
+        for det in detections:
+            x, y, w, h = det.bbox
+            self.record("detection", self.code(det.category), det.score, int(x), int(y), int(w), int(h), t=t)
+
+    def flush(self):
+        with self._lock:
+            for stream in STREAMS:
+                self._flush(stream)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            for stream in STREAMS:
+                self._flush(stream)
+            self._file.close()
+            self._file = None
+
+    def _flush(self, stream):
+        columns = self._columns[stream]
+        rows = len(columns[0])
+        if not rows or self._file is None:
+            return
+        parts = [CHUNK.pack(b"ROWS", STREAM_IDS[stream], 0, rows)]
+        for column in columns:
+            data = column.tobytes()
+            parts.append(data)
+            parts.append(_padding(len(data)))
+        self._file.write(b"".join(parts))
+        self._file.flush()
+        self._columns[stream] = self._new_columns(stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class Recording(object):
+    """Memory-mapped reader for a recording.
+
+    Opening one only walks the chunk headers. Columns are read straight
+    out of the map, and chunks() hands out zero-copy memoryviews, which
+    must be released before close(). A chunk cut short by a crash is
+    ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.names = {}
+        self._chunks = {stream: [] for stream in STREAMS}
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError("%s is empty" % path)
+        self._index()
+
+    def _index(self):
+        size = len(self._map)
+        if size < HEADER.size:
+            raise ValueError("%s is not a picar recording" % self.path)
+        magic, version, byte_order = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a picar recording" % self.path)
+        if version != VERSION:
+            raise ValueError("%s is recording version %s, this reader knows %s" % (self.path, version, VERSION))
+        if byte_order != _BYTE_ORDERS[sys.byteorder]:
+            raise ValueError("%s was recorded on a machine with a different byte order" % self.path)
+        pos = HEADER.size
+        while pos + CHUNK.size <= size:
+            tag, ident, _, count = CHUNK.unpack_from(self._map, pos)
+            pos += CHUNK.size
+            if tag == b"NAME":
+                if pos + count > size:
+                    break
+                self.names[ident] = self._map[pos:pos + count].decode()
+                pos += count + (-count % 8)
+            elif tag == b"ROWS":
+                stream = STREAM_NAMES[ident]
+                offsets = []
+                for typecode in ['q'] + [typecode for _, typecode in STREAMS[stream]]:
+                    nbytes = count * array(typecode).itemsize
+                    offsets.append((pos, nbytes))
+                    pos += nbytes + (-nbytes % 8)
+                if pos > size:
+                    break
+                self._chunks[stream].append((count, offsets))
+            else:
+                raise ValueError("corrupt chunk at byte %d of %s" % (pos - CHUNK.size, self.path))
+
+    def columns(self, stream):
+        return ['t'] + [name for name, _ in STREAMS[stream]]
+
+    def count(self, stream):
+        return sum(rows for rows, _ in self._chunks[stream])
+
+    def chunks(self, stream):
+        """Yield each chunk as {column: memoryview} without copying."""
+        typecodes = ['q'] + [typecode for _, typecode in STREAMS[stream]]
+        view = memoryview(self._map)
+        for rows, offsets in self._chunks[stream]:
+            yield {name: view[start:start + nbytes].cast(typecode)
+                   for name, typecode, (start, nbytes) in zip(self.columns(stream), typecodes, offsets)}
+
+    def column(self, stream, name):
+        """One column of every chunk, concatenated into an array."""
+        index = self.columns(stream).index(name)
+        typecode = 'q' if index == 0 else STREAMS[stream][index - 1][1]
+        result = array(typecode)
+        with memoryview(self._map) as view:
+            for rows, offsets in self._chunks[stream]:
+                start, nbytes = offsets[index]
+                result.frombytes(view[start:start + nbytes])
+        return result
+
+    def rows(self, stream):
+        """Yield (t, field, ...) tuples, detection categories come back as names."""
+        columns = [self.column(stream, name) for name in self.columns(stream)]
+        for row in zip(*columns):
+            if stream == "detection":
+                row = (row[0], self.names.get(row[1])) + row[2:]
+            yield row
+
+    def events(self):
+        """Yield (stream, row) for every row of every stream in time order."""
+        def tagged(stream):
+            for row in self.rows(stream):
+                yield stream, row
+        return heapq.merge(*[tagged(stream) for stream in STREAMS], key=lambda event: event[1][0])
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class _Series(object):
+    __slots__ = ('ts', 'values', 'cursor')
+
+    def __init__(self):
+        self.ts = []
+        self.values = []
+        self.cursor = 0
+
+    def next(self):
+        if self.cursor >= len(self.ts):
+            return None
+        self.cursor += 1
+        return self.ts[self.cursor - 1], self.values[self.cursor - 1]
+
+    def at(self, t):
+        i = max(bisect.bisect_right(self.ts, t) - 1, 0)
+        return self.ts[i], self.values[i]
+
+class Replay(object):
+    """Serves sensor readings from a recording.
+
+    By default every read returns the next recorded reading for that
+    sensor, so a run can be repeated exactly as fast as the code asks for
+    readings. Ultrasonic readings are kept per servo angle and served from
+    the nearest recorded angle, so a changed sweep still gets real data.
+
+    With realtime=True reads return whatever was recorded at the same
+    point of the run, scaled by speed, looping at the end if loop is set.
+    Polled sensors (wheel speed, detections) always work that way.
+    """
+
+    def __init__(self, recording, realtime=False, speed=1.0, loop=False):
+        self.realtime = realtime
+        self.speed = speed
+        self.loop = loop
+        self.angle = 0
+        self._lock = threading.Lock()
+        self._distances = self._group(recording, "ultrasonic", "angle", "distance", round)
+        self._angles = sorted(self._distances)
+        self._grayscale = self._group(recording, "grayscale", "channel", "value")
+        self._speeds = self._group(recording, "speed", "wheel", "speed")
+        self._frames = _Series()
+        for t, category, score, x, y, w, h in recording.rows("detection"):
+            if not self._frames.ts or self._frames.ts[-1] != t:
+                self._frames.ts.append(t)
+                self._frames.values.append([])
+            if category is not None:
+                self._frames.values[-1].append((category, score, (x, y, w, h)))
+        starts = [series.ts[0] for group in (self._distances, self._grayscale, self._speeds) for series in group.values()]
+        ends = [series.ts[-1] for group in (self._distances, self._grayscale, self._speeds) for series in group.values()]
+        if self._frames.ts:
+            starts.append(self._frames.ts[0])
+            ends.append(self._frames.ts[-1])
+        self.start = min(starts, default=0)
+        self.end = max(ends, default=0)
+        self._t = self.start
+        self._started = time.monotonic_ns()
+
+    @staticmethod
+    def _group(recording, stream, key_column, value_column, key=int):
+        groups = {}
+        keys = recording.column(stream, key_column)
+        values = recording.column(stream, value_column)
+        for t, k, value in zip(recording.column(stream, "t"), keys, values):
+            series = groups.setdefault(key(k), _Series())
+            series.ts.append(t)
+            series.values.append(value)
+        return groups
+
+    def now(self):
+        """The point of the recording the replay is at, in recorded monotonic ns."""
+        if not self.realtime:
+            return self._t
+        elapsed = int((time.monotonic_ns() - self._started) * self.speed)
+        if self.loop:
+            elapsed %= max(self.end - self.start, 1)
+        elif self.start + elapsed > self.end:
+            raise ReplayFinished("reached the end of the recording")
+        return self.start + elapsed
+
+    def _read(self, series, what):
+        if series is None:
+            raise ReplayFinished("the recording has no %s" % what)
+        if self.realtime:
+            return series.at(self.now())[1]
+        with self._lock:
+            sample = series.next()
+            if sample is None:
+                raise ReplayFinished("ran out of %s" % what)
+            self._t = max(self._t, sample[0])
+        return sample[1]
+
+    def distance(self, angle):
+        if not self._angles:
+            return self._read(None, "ultrasonic readings")
+        i = bisect.bisect_left(self._angles, angle)
+        nearest = min(self._angles[max(i - 1, 0):i + 1], key=lambda a: abs(a - angle))
+        return self._read(self._distances[nearest], "ultrasonic readings at %s degrees" % nearest)
+
+    def grayscale(self, channel):
+        return self._read(self._grayscale.get(channel), "grayscale channel %s readings" % channel)
+
+    def wheel_speed(self, wheel):
+        series = self._speeds.get(wheel)
+        return series.at(self.now())[1] if series is not None else 0
+
+    def detections(self):
+        """(t, [(category, score, bbox), ...]) of the newest frame, t is None before the first."""
+        if not self._frames.ts:
+            return None, []
+        t = self.now()
+        if t < self._frames.ts[0]:
+            return None, []
+        return self._frames.at(t)
+
+########################################################
+# Devices
+class _NullPin(object):
+    def value(self, *args):
+        return 0
+
+    def pulse_width_percent(self, *args):
+        pass
+
+class _ReplayServo(object):
+    def __init__(self, replay):
+        self.replay = replay
+
+    def set_angle(self, angle):
+        self.replay.angle = max(-90, min(90, int(angle)))
+
+class _ReplayUltrasonic(object):
+    def __init__(self, replay):
+        self.replay = replay
+
+    def get_distance(self):
+        return self.replay.distance(self.replay.angle)
+
+class _ReplayADC(object):
+    def __init__(self, replay, channel):
+        self.replay = replay
+        self.channel = channel
+
+    def read(self):
+        return self.replay.grayscale(self.channel)
+
+class _ReplaySpeed(object):
+    def __init__(self, replay, wheel):
+        self.replay = replay
+        self.wheel = wheel
+
+    def start(self):
+        pass
+
+    def deinit(self):
+        pass
+
+    def __call__(self):
+        return self.replay.wheel_speed(self.wheel)
+
+class _RecordedSpeed(object):
+    # Speed is read by calling it, which can't be patched on the instance
+    def __init__(self, speed, wheel):
+        self._speed = speed
+        self._wheel = wheel
+
+    def __call__(self):
+        value = self._speed()
+        recorder = _recorder
+        if recorder is not None:
+            recorder.record("speed", self._wheel, value)
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self._speed, name)
+
+_recorder = None
+_replay = None
+_instrumented = False
+_servo_angle = 0
+
+def _instrument(name, device):
+    """Make the device report its readings and commands to the active recorder."""
+    if name == "servo":
+        set_angle = device.set_angle
+        def recorded_set_angle(angle):
+            global _servo_angle
+            set_angle(angle)
+            _servo_angle = max(-90, min(90, int(angle)))
+        device.set_angle = recorded_set_angle
+    elif name == "us":
+        get_distance = device.get_distance
+        def recorded_get_distance():
+            distance = get_distance()
+            recorder = _recorder
+            if recorder is not None:
+                recorder.record("ultrasonic", _servo_angle, distance)
+            return distance
+        device.get_distance = recorded_get_distance
+    elif name.startswith("gs"):
+        read, channel = device.read, int(name[2:])
+        def recorded_read():
+            value = read()
+            recorder = _recorder
+            if recorder is not None:
+                recorder.record("grayscale", channel, value)
+            return value
+        device.read = recorded_read
+    elif name in MOTOR_IDS:
+        # the motor scheduler calls _set_power directly while ramping
+        set_power, motor = device._set_power, MOTOR_IDS[name]
+        def recorded_set_power(power):
+            recorder = _recorder
+            if recorder is not None:
+                recorder.record("motor", motor, power)
+            set_power(power)
+        device._set_power = recorded_set_power
+    elif name in WHEEL_IDS:
+        device = _RecordedSpeed(device, WHEEL_IDS[name])
+    return device
+
+def _instrument_devices():
+    global _instrumented
+    with fc._devices_lock:
+        if _instrumented:
+            return
+        for name, factory in list(fc._device_factories.items()):
+            fc._device_factories[name] = lambda name=name, factory=factory: _instrument(name, factory())
+        for name, device in list(fc._devices.items()):
+            fc._devices[name] = _instrument(name, device)
+        _instrumented = True
+
+def start_recording(path, chunk_rows=4096):
+    """Record every sensor reading and motor command of this process to path.
+
+    Detections are recorded by the detector through record_detections().
+    """
+    global _recorder
+    _instrument_devices()
+    stop_recording()
+    _recorder = Recorder(path, chunk_rows)
+    atexit.register(stop_recording)
+    return _recorder
+
+def stop_recording():
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
+
+def active_recorder():
+    return _recorder
+
+def record_detections(detections, timestamp):
+    recorder = _recorder
+    if recorder is not None:
+        recorder.record_detections(detections, timestamp)
+
+def start_replay(path, realtime=False, speed=1.0, loop=False):
+    """Swap every picar_4wd device for one fed from the recording at path.
+
+    Motors keep working, through the scheduler too, but drive nothing.
+    Start a recording afterwards to capture the commands of the replayed run.
+    """
+    global _replay
+    with Recording(path) as recording:
+        replay = Replay(recording, realtime, speed, loop)
+    devices = {
+        "servo": _ReplayServo(replay),
+        "us": _ReplayUltrasonic(replay),
+        "gs0": _ReplayADC(replay, 0),
+        "gs1": _ReplayADC(replay, 1),
+        "gs2": _ReplayADC(replay, 2),
+    }
+    for name in MOTOR_IDS:
+        devices[name] = fc.Motor(_NullPin(), _NullPin())
+    for name, wheel in WHEEL_IDS.items():
+        devices[name] = _ReplaySpeed(replay, wheel)
+    with fc._devices_lock:
+        for name, device in devices.items():
+            fc._devices[name] = _instrument(name, device) if _instrumented else device
+    _replay = replay
+    return replay
+
+def active_replay():
+    return _replay
+
+
+def test():
+    import os
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "test.rec")
+    n = 100000
+    start = time.perf_counter()
+    with Recorder(path) as recorder:
+        for i in range(n):
+            recorder.record("ultrasonic", i % 181 - 90, i * 0.01)
+            recorder.record("motor", i % 4 + 1, 10.0)
+    elapsed = time.perf_counter() - start
+    print("recorded %d rows in %.3fs (%.2fus/row), %d bytes" % (2 * n, elapsed, elapsed / (2 * n) * 1e6, os.path.getsize(path)))
+    with Recording(path) as recording:
+        start = time.perf_counter()
+        distances = recording.column("ultrasonic", "distance")
+        print("read %d distances in %.2fms" % (len(distances), (time.perf_counter() - start) * 1000))
+        replay = Replay(recording)
+    print("replayed distance at 0 degrees: %s" % replay.distance(0))
+
+if __name__ == '__main__':
+    test()
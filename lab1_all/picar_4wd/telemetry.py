@@ -0,0 +1,96 @@
+import threading
+import time
+from picar_4wd import utils
+
+class Telemetry(object):
+    """Background sampler for the system readings returned by pi_read().
+
+    Every metric is refreshed at its own rate by one daemon thread and
+    snapshot() only copies the cached values, so callers never wait on
+    /proc, /sys or the I2C bus.
+    """
+    # name -> (reader, refresh period in seconds)
+    METRICS = {
+        "cpu_temperature": (utils.cpu_temperature, 2.0),
+        "gpu_temperature": (utils.gpu_temperature, 2.0),
+        "cpu_usage": (utils.cpu_usage, 1.0),
+        "disk": (utils.disk_space, 30.0),
+        "ram": (utils.ram_info, 2.0),
+        "battery": (utils.power_read, 1.0),
+    }
+
+    def __init__(self, metrics=None):
+        self.metrics = dict(self.METRICS if metrics is None else metrics)
+        self._values = {}
+        self._due = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="Telemetry", daemon=True)
+        # Fill every value once so the first snapshot is complete
+        for name in self.metrics:
+            self._refresh(name)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    def snapshot(self):
+        return dict(self._values)
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def _refresh(self, name):
+        reader, period = self.metrics[name]
+        try:
+            value = reader()
+        except Exception as e:
+            print('telemetry %s error: %s' % (name, e))
+            value = self._values.get(name)
+        self._values[name] = value
+        self._due[name] = time.monotonic() + period
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for name, due in list(self._due.items()):
+                if due <= now:
+                    self._refresh(name)
+            next_due = min(self._due.values())
+            self._stop.wait(max(0, next_due - time.monotonic()))
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+def get_telemetry():
+    """Return the shared, already started Telemetry sampler."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry().start()
+        return _telemetry
+
+
+def test():
+    telemetry = get_telemetry()
+    while True:
+        start = time.perf_counter()
+        snapshot = utils.pi_read()
+        print("%s (%.1fus)" % (snapshot, (time.perf_counter() - start) * 1e6))
+        time.sleep(1)
+
+if __name__ == '__main__':
+    test()
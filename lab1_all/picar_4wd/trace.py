@@ -0,0 +1,123 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Tracing is off until enable() is called, or PICAR_TRACE=1 is set in the
+# environment. While off, span() hands back a shared no-op and traced
+# functions cost one global lookup.
+_enabled = False
+_events = deque(maxlen=200000)
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span(object):
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _events.append(('X', self.name, self.start, end - self.start, threading.get_ident(), self.args))
+        return False
+
+    def set(self, **args):
+        """Attach extra arguments, e.g. a result, before the span ends."""
+        if self.args is None:
+            self.args = args
+        else:
+            self.args.update(args)
+
+def enable(capacity=None):
+    """Start recording. capacity caps the number of kept events, oldest go first."""
+    global _enabled, _events
+    if capacity is not None and capacity != _events.maxlen:
+        _events = deque(_events, maxlen=capacity)
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def clear():
+    _events.clear()
+
+def span(name, **args):
+    """Time a block: `with trace.span("i2c.send", addr=0x14): ...`"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args or None)
+
+def instant(name, **args):
+    """Record a point in time, e.g. a deadline miss."""
+    if _enabled:
+        _events.append(('i', name, time.perf_counter_ns(), 0, threading.get_ident(), args or None))
+
+def traced(name=None):
+    """Decorator that wraps every call of the function in a span."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(span_name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def events():
+    return list(_events)
+
+def export_chrome(path):
+    """Write the recorded events as Chrome trace JSON.
+
+    Open the file in chrome://tracing or https://ui.perfetto.dev.
+    """
+    pid = os.getpid()
+    trace_events = []
+    threads = {}
+    for ph, name, start, dur, tid, args in list(_events):
+        event = {"name": name, "ph": ph, "ts": start / 1000, "pid": pid, "tid": tid}
+        if ph == 'X':
+            event["dur"] = dur / 1000
+        else:
+            event["s"] = "t"
+        if args:
+            event["args"] = {k: v if isinstance(v, (int, float, str, bool)) else str(v) for k, v in args.items()}
+        trace_events.append(event)
+        threads.setdefault(tid, None)
+    for thread in threading.enumerate():
+        if thread.ident in threads:
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread.ident,
+                                 "args": {"name": thread.name}})
+    with open(path, 'w') as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+    return len(trace_events)
+
+if os.environ.get('PICAR_TRACE') == '1':
+    enable()
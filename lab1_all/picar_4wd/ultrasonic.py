@@ -11,14 +11,20 @@ class Ultrasonic():
         self.timeout = timeout
         self.trig = trig
         self.echo = echo
-        # Init Servo
-        self.servo = Servo(PWM("P0"), offset=10)
+        self._servo = None
         self.angle_distance = [0,0]
         self.current_angle = 0
         self.max_angle = self.ANGLE_RANGE/2
         self.min_angle = -self.ANGLE_RANGE/2
         self.scan_list = []
 
+    @property
+    def servo(self):
+        # Init Servo on first use, most callers drive picar_4wd.servo instead
+        if self._servo is None:
+            self._servo = Servo(PWM("P0"), offset=10)
+        return self._servo
+
     def get_distance(self):
         self.trig.low()
         time.sleep(0.01)
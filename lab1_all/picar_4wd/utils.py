@@ -4,7 +4,11 @@ import subprocess
 import os
 import time
 
+# Bumped on every soft reset so cached MCU register state can be dropped
+soft_reset_count = 0
+
 def soft_reset():
+    global soft_reset_count
     from picar_4wd.pin import Pin
     soft_reset_pin = Pin("D16")
     # print('soft_reset')
@@ -12,65 +16,98 @@ def soft_reset():
     time.sleep(0.001)
     soft_reset_pin.high()
     time.sleep(0.001)
+    soft_reset_count += 1
 
 def mapping(x,min_val,max_val,aim_min,aim_max):
     x = aim_min + abs((x - min_val) / (max_val- min_val) * (aim_max-aim_min))
     return x
 
+# The helpers below read /proc and /sys directly instead of forking
+# cat/vcgencmd/mpstat/df/free, pi_read() serves them from a cached sampler.
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+
+def _read_file(path):
+    with open(path, 'r') as f:
+        return f.read()
+
 def cpu_temperature():          # cpu_temperature
-    raw_cpu_temperature = subprocess.getoutput("cat /sys/class/thermal/thermal_zone0/temp")
+    raw_cpu_temperature = _read_file(THERMAL_ZONE)
     cpu_temperature = round(float(raw_cpu_temperature)/1000,2)               # convert unit
     #cpu_temperature = 'Cpu temperature : ' + str(cpu_temperature)
     return cpu_temperature
 
 def gpu_temperature():          # gpu_temperature(
-    raw_gpu_temperature = subprocess.getoutput( '/opt/vc/bin/vcgencmd measure_temp' )
-    gpu_temperature = round(float(raw_gpu_temperature.replace( 'temp=', '' ).replace( '\'C', '' )), 2)
-    #gpu_temperature = 'Gpu temperature : ' + str(gpu_temperature)
-    return gpu_temperature
+    # The CPU and GPU share one SoC sensor, `vcgencmd measure_temp` reads the
+    # same value as thermal_zone0
+    return cpu_temperature()
+
+_last_cpu_times = None
 
 def cpu_usage():                # cpu_usage
-    # result = str(os.popen("top -n1 | awk '/Cpu\(s\):/ {print($2)}'").readline().strip())
-    result = os.popen("mpstat").read().strip()
-    result = result.split('\n')[-1].split(' ')[-1]
-    result = round(100 - float(result), 2)
+    # Busy percentage since the previous call, or since boot on the first
+    # call like plain `mpstat` reports
+    global _last_cpu_times
+    fields = _read_file("/proc/stat").split('\n', 1)[0].split()[1:]
+    times = [int(x) for x in fields]
+    idle = times[3] + times[4]      # idle + iowait
+    total = sum(times[:8])          # guest time is already part of user
+    last = _last_cpu_times
+    _last_cpu_times = (idle, total)
+    if last is not None and total > last[1]:
+        idle, total = idle - last[0], total - last[1]
+    if total <= 0:
+        return "0.0"
+    result = round(100 - idle * 100.0 / total, 2)
     result = str(result)
-    # print(result)
     return result
 
+def _human_size(num):
+    # Same format as `df -h`
+    for unit in ['', 'K', 'M', 'G', 'T']:
+        if num < 1024 or unit == 'T':
+            break
+        num /= 1024.0
+    if unit == '':
+        return str(int(num))
+    if num < 10:
+        return "%.1f%s" % (num, unit)
+    return "%d%s" % (round(num), unit)
+
 def disk_space():               # disk_space
-    p = os.popen("df -h /")
-    i = 0
-    while 1:
-        i = i +1
-        line = p.readline()         
-        if i==2:
-            return line.split()[1:5]    
+    st = os.statvfs("/")
+    total = st.f_blocks * st.f_frsize
+    free = st.f_bavail * st.f_frsize
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    percent = "%d%%" % -(-used * 100 // (used + free)) if used + free else "0%"
+    return [_human_size(total), _human_size(used), _human_size(free), percent]
 
 def ram_info():
-    p = os.popen('free')
-    i = 0
-    while 1:
-        i = i + 1
-        line = p.readline()
-        if i==2:
-            return list(map(lambda x:round(int(x) / 1000,1), line.split()[1:4]))   
+    meminfo = {}
+    for line in _read_file("/proc/meminfo").splitlines():
+        name, value = line.split(':', 1)
+        meminfo[name] = int(value.split()[0])
+    total = meminfo["MemTotal"]
+    free = meminfo["MemFree"]
+    if "MemAvailable" in meminfo:
+        used = total - meminfo["MemAvailable"]
+    else:
+        cache = meminfo.get("Cached", 0) + meminfo.get("SReclaimable", 0)
+        used = total - free - meminfo.get("Buffers", 0) - cache
+    # [total, used, free] in MB like the second line of `free`
+    return list(map(lambda x:round(x / 1000,1), [total, used, free]))
 
 def pi_read():
-    result = {
-        "cpu_temperature": cpu_temperature(), 
-        "gpu_temperature": gpu_temperature(),
-        "cpu_usage": cpu_usage(), 
-        "disk": disk_space(), 
-        "ram": ram_info(), 
-        "battery": power_read(), 
-    }
-    return result 
+    from picar_4wd.telemetry import get_telemetry
+    return get_telemetry().snapshot()
+
+_power_read_pin = None
 
 def power_read():
-    from picar_4wd.adc import ADC
-    power_read_pin = ADC('A4')
-    power_val = power_read_pin.read()
+    global _power_read_pin
+    if _power_read_pin is None:
+        from picar_4wd.adc import ADC
+        _power_read_pin = ADC('A4')
+    power_val = _power_read_pin.read()
     power_val = power_val / 4095.0 * 3.3
     # print(power_val)
     power_val = power_val * 3
@@ -103,6 +140,13 @@ def main():
         elif command == "power-read":
             print("power-read")
             print("Power voltage: {}V".format(power_read()))
+        elif command == "import-time":
+            import picar_4wd
+            print("Import time: {:.1f}ms (budget {:.1f}ms)".format(
+                picar_4wd.import_time * 1000, picar_4wd.IMPORT_TIME_BUDGET * 1000))
+            if picar_4wd.import_time > picar_4wd.IMPORT_TIME_BUDGET:
+                print("Import time is over budget")
+                sys.exit(1)
         elif command == "web-example":
             if len(sys.argv) >= 3:
                 opt = sys.argv[2]
@@ -157,6 +201,7 @@ Usage:  picar-4wd [Command] [option]
 Commands:
     soft-reset
     power-read
+    import-time
     web-example
     test
 '''
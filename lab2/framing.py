@@ -0,0 +1,74 @@
+import json
+import struct
+
+# A client that starts with this line wants a long-lived connection that
+# speaks length-prefixed frames. Anything else is a one-shot legacy request.
+MAGIC = b"PICAR/1\n"
+
+# every frame is a 4 byte big-endian payload length followed by the payload
+HEADER = struct.Struct(">I")
+MAX_FRAME = 64 * 1024
+
+
+class FrameError(Exception):
+    pass
+
+
+def encode_frame(payload):
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    if len(payload) > MAX_FRAME:
+        raise FrameError(f"frame of {len(payload)} bytes is over the {MAX_FRAME} byte limit")
+    return HEADER.pack(len(payload)) + payload
+
+
+def encode_message(message):
+    # messages are JSON objects, e.g. {"type": "key", "key": 87}
+    return encode_frame(json.dumps(message, separators=(",", ":")))
+
+
+def decode_message(payload):
+    return json.loads(payload.decode("utf-8"))
+
+
+class FrameReader:
+    """Incremental frame decoder.
+
+    Feed it whatever recv() returned and it hands back every complete
+    frame, keeping partial ones for the next call. This is what lets a
+    client pipeline several commands into a single TCP segment.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer)
+            if length > MAX_FRAME:
+                raise FrameError(f"frame of {length} bytes is over the {MAX_FRAME} byte limit")
+            end = HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append(bytes(self.buffer[HEADER.size:end]))
+            del self.buffer[:end]
+        return frames
+
+    def messages(self, data):
+        return [decode_message(frame) for frame in self.feed(data)]
+
+
+def test():
+    reader = FrameReader()
+    stream = encode_message({"type": "key", "key": 87}) + encode_message({"type": "key", "key": 88})
+    # split in the middle of the second header to check partial frames are kept
+    first = reader.messages(stream[:len(stream) - 10])
+    second = reader.messages(stream[len(stream) - 10:])
+    print(f"first read: {first}, second read: {second}")
+    assert first == [{"type": "key", "key": 87}] and second == [{"type": "key", "key": 88}]
+
+
+if __name__ == "__main__":
+    test()
@@ -1,54 +1,94 @@
 document.onkeydown = updateKey;
 document.onkeyup = resetKey;
+window.addEventListener('load', () => {
+    connect();
+    start_video();
+});
 
 var server_port = 8080;
 var server_addr = "192.168.50.45";   // the IP address of your Raspberry PI
+var video_port = 9000;   // port of video_stream.py on the Pi
 
 
-function client(){
-    
+// one long-lived connection carries the key presses and the telemetry the
+// Pi pushes back, see framing.py for the wire format
+const MAGIC = "PICAR/1\n";
+var connection = null;
+var recv_buffer = Buffer.alloc(0);
+
+function connect(){
+    if (connection != null) {
+        return connection;
+    }
     const net = require('net');
-    var input = document.getElementById("message").value;
 
-    const client = net.createConnection({ port: server_port, host: server_addr }, () => {
+    connection = net.createConnection({ port: server_port, host: server_addr }, () => {
         // 'connect' listener.
         console.log('connected to server!');
-        // send the message
-        client.write(`${input}\r\n`);
     });
-    
+    connection.setNoDelay(true);
+    // ask for the persistent framed protocol instead of one request per connection
+    connection.write(MAGIC);
+
     // get the data from the server
-    client.on('data', (data) => {
-        const data_ret = data.toString().split("\n")
-        temp = data_ret[0]
-        speed = data_ret[1]
-        power_supply = data_ret[2]
-
-        document.getElementById("cpu_temperature").innerHTML = temp
-        document.getElementById("speed").innerHTML = speed
-        document.getElementById("power_supply").innerHTML = power_supply
-
-        console.log(data.toString());
-        client.end();
-        client.destroy();
+    connection.on('data', (data) => {
+        recv_buffer = Buffer.concat([recv_buffer, data]);
+        // each frame is a 4 byte big-endian length followed by a JSON message
+        while (recv_buffer.length >= 4) {
+            const length = recv_buffer.readUInt32BE(0);
+            if (recv_buffer.length < 4 + length) {
+                break;
+            }
+            const message = JSON.parse(recv_buffer.subarray(4, 4 + length).toString());
+            recv_buffer = recv_buffer.subarray(4 + length);
+            if (message.type == "telemetry") {
+                show_telemetry(message);
+            }
+        }
     });
 
-    client.on('end', () => {
+    connection.on('error', (err) => {
+        console.log(`connection error: ${err.message}`);
+    });
+
+    connection.on('close', () => {
         console.log('disconnected from server');
+        connection = null;
+        recv_buffer = Buffer.alloc(0);
+        // try again in a second
+        setTimeout(connect, 1000);
     });
+    return connection;
+}
 
+// the Pi streams MJPEG over one long-lived HTTP response, the <img> tag plays
+// it as frames arrive. if the stream drops, try again in a second
+function start_video(){
+    const pics = document.getElementById("pics");
+    pics.onerror = () => {
+        pics.src = "./media/default_background.png";
+        setTimeout(start_video, 1000);
+    };
+    pics.src = `http://${server_addr}:${video_port}/stream`;
+}
 
+function show_telemetry(message){
+    document.getElementById("cpu_temperature").innerHTML = `${message.temp} C`
+    document.getElementById("speed").innerHTML = message.speed
+    document.getElementById("power_supply").innerHTML = `${message.power_supply}V`
+}
+
+function client(){
+    var input = document.getElementById("message").value;
+    send_data(input);
 }
 
 function send_data(input){
-    const net = require('net');
- 
-    const client = net.createConnection({ port: server_port, host: server_addr }, () => {
-        // 'connect' listener.
-        console.log('connected to server!');
-        // send the message
-        client.write(`${input}`);
-    });
+    const payload = Buffer.from(JSON.stringify({ type: "key", key: parseInt(input) }));
+    const header = Buffer.alloc(4);
+    header.writeUInt32BE(payload.length, 0);
+    // writes are queued until the socket connects, so key presses are never lost
+    connect().write(Buffer.concat([header, payload]));
 }
 
 // for detecting which key is been pressed w,a,s,d
@@ -98,13 +138,7 @@ function resetKey(e) {
 }
 
 
-// update data for every 50ms
+// telemetry is pushed by the Pi once connected, the button sends the message box
 function update_data(){
-    /*
-    setInterval(function(){
-        // get image from python server
-        client();
-    }, 50);
-    */
     client()
 }
\ No newline at end of file
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import time
+from random import choice
+from framing import MAGIC, FrameReader, encode_message
+
+HOST = "192.168.50.45" # IP address of your Raspberry PI
+PORT = 8080          # The port used by the server
+
+# keys the swarm presses. By default only X, which stops the car, so the test
+# is safe to run with the car on the floor. --drive mixes in forward and
+# backward, only use it with the car lifted off the ground.
+KEYS = [88]
+DRIVE_KEYS = [87, 83, 88]
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    if not samples:
+        return float("nan")
+    index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+    return samples[index]
+
+async def persistent_client(host, port, requests, interval, latencies):
+    # one long-lived connection, every key is timed until its ack comes back
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(MAGIC)
+    frames = FrameReader()
+    sent = {}
+    try:
+        for seq in range(requests):
+            sent[seq] = time.perf_counter()
+            writer.write(encode_message({"type": "key", "key": choice(KEYS), "seq": seq}))
+            await writer.drain()
+            # telemetry pushes arrive on the same connection, skip past them
+            while seq in sent:
+                data = await reader.read(4096)
+                if data == b"":
+                    raise ConnectionError("server closed the connection")
+                for message in frames.messages(data):
+                    if message.get("type") == "ack":
+                        latencies.append(time.perf_counter() - sent.pop(message["seq"]))
+            await asyncio.sleep(interval)
+    finally:
+        writer.close()
+
+async def legacy_client(host, port, requests, interval, latencies):
+    # the old protocol: connect, send a key, wait for the reply, hang up
+    for _ in range(requests):
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(str(choice(KEYS)).encode())
+        await reader.read(1024)
+        latencies.append(time.perf_counter() - start)
+        writer.close()
+        await asyncio.sleep(interval)
+
+async def swarm(host, port, clients, requests, interval, legacy):
+    latencies = []
+    client = legacy_client if legacy else persistent_client
+    start = time.perf_counter()
+    results = await asyncio.gather(*[client(host, port, requests, interval, latencies) for _ in range(clients)],
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = [r for r in results if isinstance(r, Exception)]
+
+    print(f"{clients} {'legacy' if legacy else 'persistent'} clients, {len(latencies)} responses in {round(elapsed,2)}s, {len(errors)} clients failed")
+    if errors:
+        print(f"first error: {errors[0]!r}")
+    for p in (50, 90, 99):
+        print(f"p{p}: {round(percentile(latencies, p) * 1000, 2)} ms")
+    return latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hammer wifi_server.py with concurrent clients and report response times")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=100, help="key presses per client")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between key presses")
+    parser.add_argument("--legacy", action="store_true", help="use one connection per key press")
+    parser.add_argument("--drive", action="store_true", help="also press forward/backward, lift the car first")
+    args = parser.parse_args()
+    if args.drive:
+        KEYS = DRIVE_KEYS
+    asyncio.run(swarm(args.host, args.port, args.clients, args.requests, args.interval, args.legacy))
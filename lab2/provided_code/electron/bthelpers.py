@@ -1,38 +1,224 @@
-import bluetooth
 import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+try:
+    import bluetooth
+except ImportError:
+    # lets the framing and batching be tested on a machine without PyBluez
+    bluetooth = None
 
 target_name = "raspberrypi"
-sock = None
+channel = None
 
-# TODO: Implement server for p2p comms
+# name -> address of devices found before, discovery takes ~10s per run
+ADDRESS_CACHE = os.path.expanduser("~/.bt_address_cache.json")
 
-def start_client():    
-    target_address = None
-    nearby_devices = bluetooth.discover_devices()
+# every message is a 4 byte big-endian length followed by its JSON payload
+HEADER = struct.Struct(">I")
+MAX_FRAME = 64 * 1024
+
+
+def _load_address_cache():
+    try:
+        with open(ADDRESS_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def find_address(name, refresh=False):
+    """Return the address of the device called name, or None.
 
-    for bdaddr in nearby_devices:
-        print(bluetooth.lookup_name( bdaddr ))
-        if target_name == bluetooth.lookup_name( bdaddr ):
+    Hits the cache file first. Discovery asks for names in the same
+    inquiry instead of a lookup_name() round trip per device.
+    """
+    cache = _load_address_cache()
+    if not refresh and name in cache:
+        return cache[name]
+
+    target_address = None
+    for bdaddr, device_name in bluetooth.discover_devices(lookup_names=True):
+        print(device_name)
+        if device_name == name:
             target_address = bdaddr
             break
 
     if target_address is not None:
         print ("found target bluetooth device with address ", target_address)
+        cache[name] = target_address
+        with open(ADDRESS_CACHE, "w") as f:
+            json.dump(cache, f)
     else:
         print ("could not find target bluetooth device nearby")
+    return target_address
+
+
+class RfcommChannel:
+    """Length-prefixed JSON messages over an RFCOMM (or any stream) socket.
+
+    send() only queues the message. A writer thread drains the queue and
+    packs whatever arrives within max_delay into one write, up to
+    max_batch bytes, so a burst of small messages costs one trip over the
+    slow link instead of one each.
+    """
 
-    port = 1
+    def __init__(self, sock, max_delay=0.005, max_batch=4096):
+        self.sock = sock
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.writes = 0  # socket writes made, to compare against messages sent
+        self._queue = queue.Queue()
+        self._buffer = bytearray()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="RfcommWriter", daemon=True)
+        self._writer.start()
 
-    sock=bluetooth.BluetoothSocket( bluetooth.RFCOMM )
-    sock.connect((target_address, port))      
+    @classmethod
+    def connect(cls, name=None, address=None, port=1, **kwargs):
+        if address is None:
+            address = find_address(name)
+            if address is None:
+                raise OSError(f"no bluetooth device called {name}")
+        sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        try:
+            sock.connect((address, port))
+        except OSError:
+            # the cached address may be stale, look the device up again once
+            if name is None:
+                raise
+            sock.close()
+            address = find_address(name, refresh=True)
+            if address is None:
+                raise OSError(f"bluetooth device {name} not found, is it on and in range?")
+            sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+            sock.connect((address, port))
+        return cls(sock, **kwargs)
+
+    @classmethod
+    def accept(cls, port=1, **kwargs):
+        server_sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        server_sock.bind(("", port))
+        server_sock.listen(1)
+        client_sock, address = server_sock.accept()
+        print ("Accepted connection from ", address)
+        server_sock.close()
+        return cls(client_sock, **kwargs)
+
+    def send(self, message):
+        if self._closed:
+            raise OSError("channel is closed")
+        payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+        if len(payload) > MAX_FRAME:
+            raise ValueError(f"message of {len(payload)} bytes is over the {MAX_FRAME} byte limit")
+        self._queue.put(HEADER.pack(len(payload)) + payload)
+
+    def recv(self):
+        """Block until the next message arrives. Returns None once the peer closes."""
+        header = self._recv_exactly(HEADER.size)
+        if header is None:
+            return None
+        (length,) = HEADER.unpack(header)
+        if length > MAX_FRAME:
+            raise ValueError(f"frame of {length} bytes is over the {MAX_FRAME} byte limit")
+        payload = self._recv_exactly(length)
+        if payload is None:
+            return None
+        return json.loads(payload.decode("utf-8"))
+
+    def close(self):
+        """Flush whatever is queued, then close the socket."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        self.sock.close()
+
+    def _recv_exactly(self, size):
+        while len(self._buffer) < size:
+            data = self.sock.recv(max(1024, size - len(self._buffer)))
+            if not data:
+                return None
+            self._buffer += data
+        chunk = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return chunk
+
+    def _send_all(self, data):
+        view = memoryview(data)
+        while view:
+            sent = self.sock.send(view)
+            view = view[sent:]
+        self.writes += 1
+
+    def _write_loop(self):
+        # a frame that didn't fit in the last batch starts the next one
+        pending = None
+        while True:
+            frame = pending if pending is not None else self._queue.get()
+            pending = None
+            if frame is None:
+                return
+            # a single frame over max_batch still goes out, on its own
+            batch = bytearray(frame)
+            # Nagle-style: wait a moment for more small messages to join
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    frame = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if frame is None:
+                    stop = True
+                    break
+                if len(batch) + len(frame) > self.max_batch:
+                    pending = frame
+                    break
+                batch += frame
+            try:
+                self._send_all(batch)
+            except OSError as e:
+                print(f"bluetooth send failed: {e}")
+                return
+            if stop:
+                return
+
+
+def start_client():
+    global channel
+    channel = RfcommChannel.connect(target_name)
 
 def set_target(target):
+    global target_name
     target_name = target
 
 def send_data(data):
-    sock.send(json.dumps(data))
+    channel.send(data)
 
 def terminate():
-    sock.close()
+    channel.close()
+
 
+def test():
+    # a local socketpair stands in for the bluetooth link
+    left, right = socket.socketpair()
+    sender, receiver = RfcommChannel(left), RfcommChannel(right)
+    count = 2000
+    start = time.perf_counter()
+    for i in range(count):
+        sender.send({"key": 87, "i": i})
+    received = [receiver.recv() for _ in range(count)]
+    elapsed = time.perf_counter() - start
+    sender.close()
+    assert [m["i"] for m in received] == list(range(count))
+    assert receiver.recv() is None
+    receiver.close()
+    print(f"{count} messages in {round(elapsed * 1000, 1)} ms using {sender.writes} socket writes")
 
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,191 @@
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+HOST = "192.168.50.45" # IP address of your Raspberry PI
+PORT = 9000          # Port the MJPEG stream is served on
+
+BOUNDARY = b"frame"
+
+
+class FrameHub:
+    """Holds only the newest encoded frame.
+
+    Every client waits for a frame newer than the last one it sent. A
+    client that falls behind skips straight to the latest frame, so the
+    frames it missed are dropped rather than queued (drop-oldest with a
+    queue length of one). The frame is encoded once and the same buffer
+    is written to every client.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self.clients = 0
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def add_client(self):
+        with self._condition:
+            self.clients += 1
+
+    def remove_client(self):
+        with self._condition:
+            self.clients -= 1
+
+    def publish(self, frame):
+        with self._condition:
+            self._frame = frame
+            self._seq += 1
+            self._condition.notify_all()
+
+    def wait_next(self, last_seq, timeout=1.0):
+        # returns (seq, frame), frame is None if nothing new came in time
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq != last_seq, timeout)
+            if self._seq == last_seq:
+                return last_seq, None
+            return self._seq, self._frame
+
+
+class Camera(threading.Thread):
+    """Captures into one preallocated buffer and encodes at a fixed rate.
+
+    Encoding only happens while at least one client is watching, so an
+    idle stream costs a camera read and nothing else.
+    """
+
+    def __init__(self, hub, camera_id=0, width=320, height=240, fps=15, quality=70):
+        super().__init__(name="Camera", daemon=True)
+        self.hub = hub
+        self.interval = 1 / fps
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        self.cap = cv2.VideoCapture(camera_id)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        # VideoCapture.read() fills this in place when the size matches
+        self.image = np.empty((height, width, 3), dtype=np.uint8)
+        self.stopped = threading.Event()
+
+    def run(self):
+        next_frame = time.monotonic()
+        while not self.stopped.is_set():
+            success, image = self.cap.read(self.image)
+            if not success:
+                print("ERROR: Unable to read from the camera.")
+                self.stopped.wait(1)
+                continue
+            # the driver hands back a new array if it could not use ours
+            self.image = image
+            if self.hub.clients == 0 or time.monotonic() < next_frame:
+                continue
+            next_frame += self.interval
+            # skip ahead instead of bursting after a stall
+            next_frame = max(next_frame, time.monotonic())
+            success, jpeg = cv2.imencode(".jpg", image, self.encode_params)
+            if success:
+                self.hub.publish(memoryview(jpeg))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.cap.release()
+
+
+def make_handler(hub):
+
+    class StreamHandler(BaseHTTPRequestHandler):
+        # one long-lived multipart/x-mixed-replace response per client,
+        # an <img> tag pointed at /stream plays it with no client code
+
+        def do_GET(self):
+            if self.path.startswith("/stream"):
+                self.stream()
+            elif self.path.startswith("/snapshot.jpg"):
+                self.snapshot()
+            else:
+                self.send_error(404)
+
+        def snapshot(self):
+            hub.add_client()
+            try:
+                # wait for a fresh frame, the last one may be old if nobody was watching
+                seq, frame = hub.wait_next(hub.seq, timeout=2.0)
+            finally:
+                hub.remove_client()
+            if frame is None:
+                self.send_error(503, "no frame from the camera")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(frame)))
+            self.end_headers()
+            self.wfile.write(frame)
+
+        def stream(self):
+            self.send_response(200)
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=" + BOUNDARY.decode())
+            self.end_headers()
+            hub.add_client()
+            seq, dropped = 0, 0
+            try:
+                while True:
+                    new_seq, frame = hub.wait_next(seq)
+                    if frame is None:
+                        continue
+                    if seq:
+                        dropped += new_seq - seq - 1
+                    seq = new_seq
+                    self.wfile.write(b"--" + BOUNDARY + b"\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                                     + str(len(frame)).encode() + b"\r\n\r\n")
+                    self.wfile.write(frame)
+                    self.wfile.write(b"\r\n")
+            except OSError:
+                # the viewer went away
+                pass
+            finally:
+                hub.remove_client()
+                print(f"{self.client_address} stopped watching, {dropped} frames dropped")
+
+        def log_message(self, format, *args):
+            pass
+
+    return StreamHandler
+
+
+def serve(host=HOST, port=PORT, camera_id=0, width=320, height=240, fps=15, quality=70):
+    hub = FrameHub()
+    camera = Camera(hub, camera_id, width, height, fps, quality)
+    camera.start()
+    server = ThreadingHTTPServer((host, port), make_handler(hub))
+    server.daemon_threads = True
+    print(f"Streaming on http://{host}:{port}/stream")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        camera.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream the car camera as MJPEG over HTTP")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--camera", type=int, default=0)
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--fps", type=float, default=15, help="frames encoded per second")
+    parser.add_argument("--quality", type=int, default=70, help="JPEG quality, 0-100")
+    args = parser.parse_args()
+    try:
+        serve(args.host, args.port, args.camera, args.width, args.height, args.fps, args.quality)
+    except KeyboardInterrupt:
+        print("Closing stream")
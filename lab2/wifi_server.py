@@ -1,8 +1,10 @@
+import asyncio
 import socket
 import psutil
 import picar_4wd as fc
-from time import sleep
+from picar_4wd.telemetry import Telemetry
 from random import random
+from framing import MAGIC, FrameReader, FrameError, encode_message
 
 HOST = "192.168.50.45" # IP address of your Raspberry PI
 PORT = 8080          # Port to listen on (non-privileged ports are > 1023)
@@ -10,10 +12,27 @@ PORT = 8080          # Port to listen on (non-privileged ports are > 1023)
 TURN_POWER = 10 # turn power
 CAR_POWER_ACT = 0 # actual power of the car
 CAR_POWER_SET = 20 # what we will set the car power to when moving forwar/backward
+TELEMETRY_INTERVAL = 0.1 # seconds between telemetry pushes on a persistent connection
+MAX_BACKLOG = 64 * 1024 # skip pushes to a subscriber with this many bytes still unsent
+
+# the timer that ends the current turn, any new key cancels it
+turn_timer = None
+# writers of the persistent connections that get the telemetry broadcast
+subscribers = set()
+
+def end_turn():
+    global turn_timer
+    turn_timer = None
+    fc.stop()
 
 def move_car_keystroke(k):
-    
-    global CAR_POWER_ACT
+
+    global CAR_POWER_ACT, turn_timer
+
+    # a new key replaces whatever turn is still running
+    if turn_timer is not None:
+        turn_timer.cancel()
+        turn_timer = None
 
     # key 87 = W
     if k == 87:
@@ -27,12 +46,13 @@ def move_car_keystroke(k):
     elif k == 65:
         CAR_POWER_ACT = 0 # speed is 0
         fc.turn_left(TURN_POWER)
-        sleep(random())
+        # turn for a moment without holding up the other clients
+        turn_timer = asyncio.get_running_loop().call_later(random(), end_turn)
     # key 68 = D
     elif k == 68:
         CAR_POWER_ACT = 0 # speed is 0
         fc.turn_right(TURN_POWER)
-        sleep(random())
+        turn_timer = asyncio.get_running_loop().call_later(random(), end_turn)
     # key 88 = X (stops the car)
     elif k == 88:
         CAR_POWER_ACT = 0
@@ -46,49 +66,138 @@ def get_speed(car_power):
     speed = extra + 26.7 if car_power > 0 else 0
 
     return speed
-        
 
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.bind((HOST, PORT))
-    s.listen()
 
+def read_cpu_temperature():
+    # get Pi CPU temp
+    temp = psutil.sensors_temperatures()['cpu_thermal'][0].current
+    return round(float(temp),2)
+
+def read_power_supply():
+    # get car's power supply reading
+    return round(float(fc.power_read()),2)
+
+# psutil walks all of hwmon and power_read goes over I2C, so a background
+# thread refreshes them and replies are served from memory
+# name -> (reader, seconds a value stays fresh)
+telemetry = Telemetry({
+    "temp": (read_cpu_temperature, 2.0),
+    "power_supply": (read_power_supply, 1.0),
+})
+
+def get_telemetry():
+    return {
+        "temp": telemetry.get("temp"),
+        # get car's speed
+        "speed": round(float(get_speed(CAR_POWER_ACT)),2),
+        "power_supply": telemetry.get("power_supply"),
+    }
+
+def handle_keystroke(data_decode):
+    # try to convert decoded data to an integer if it is a keystroke number
+    # if it is not, continue as normal
+    try:
+        data_decode_int = int(data_decode)
+    except (TypeError, ValueError):
+        print("Data is not a keystroke number.")
+        return
+    print(f"Data is the keystroke number {data_decode_int}. Engaging PiCar.")
+    move_car_keystroke(data_decode_int)
+
+async def handle_legacy(writer, data):
+    # one request per connection: a keystroke in, one telemetry reply out
+
+    # decode the data from the client from bytes into a string and remove
+    # extra whitespace
+    handle_keystroke(data.decode().strip())
+
+    reading = get_telemetry()
+    # data to echo back to client
+    data_ret = bytes(f"{reading['temp']} C\n{reading['speed']}\n{reading['power_supply']}V\n","utf-8")
+    writer.write(data_ret) # Echo back to client
+    await writer.drain()
+
+async def handle_persistent(reader, writer, data):
+    # long-lived connection: length-prefixed JSON frames both ways
+    #   client -> server {"type": "key", "key": 87, "seq": 1}
+    #   server -> client {"type": "ack", "seq": 1}
+    #                    {"type": "telemetry", "temp": .., "speed": .., "power_supply": ..}
+    # commands can be pipelined, they are dispatched in the order they arrive
+    # and acked when they carry a seq
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    subscribers.add(writer)
+    frames = FrameReader()
+    try:
+        while True:
+            for message in frames.messages(data):
+                if not isinstance(message, dict):
+                    print(f"Skipping message that is not an object: {message!r}")
+                    continue
+                if message.get("type") == "key":
+                    handle_keystroke(message.get("key"))
+                    if "seq" in message:
+                        writer.write(encode_message({"type": "ack", "seq": message["seq"]}))
+                else:
+                    print(f"Unknown message: {message}")
+            await writer.drain()
+            data = await reader.read(1024)
+            if data == b"":
+                break
+    except (FrameError, ValueError) as e:
+        print(f"Dropping client after a bad frame: {e}")
+    finally:
+        subscribers.discard(writer)
+
+async def broadcast_telemetry():
+    # one frame per interval, shared by every subscriber
+    loop = asyncio.get_running_loop()
+    next_push = loop.time()
+    while True:
+        if subscribers:
+            frame = encode_message(dict(type="telemetry", **get_telemetry()))
+            for writer in list(subscribers):
+                # a client that is not keeping up misses pushes instead of
+                # buffering them without limit
+                if writer.transport.get_write_buffer_size() < MAX_BACKLOG:
+                    writer.write(frame)
+        next_push += TELEMETRY_INTERVAL
+        await asyncio.sleep(max(0, next_push - loop.time()))
+
+async def handle_client(reader, writer):
+    clientInfo = writer.get_extra_info("peername")
+    print("server recv from: ", clientInfo)
     try:
-        while 1:
-            client, clientInfo = s.accept()
-            print("server recv from: ", clientInfo)
-            data = client.recv(1024)      # receive 1024 Bytes of message in binary format
-            if data != b"":
-                
-                # decode the data from the client from bytes into a string and remove
-                # extra whitespace
-                data_decode = data.decode().strip()
-                # try to convert decoded data to an integer if it is a keystroke number
-                # if it is not, continue as normal
-                try:
-                    data_decode_int = int(data_decode)
-                    print(f"Data is the keystroke number {data_decode_int}. Engaging PiCar.")
-                    move_car_keystroke(data_decode_int)
-                except ValueError:
-                    print("Data is not a keystroke number.")
-                
-                # get Pi CPU temp
-                temp = psutil.sensors_temperatures()['cpu_thermal'][0].current
-                temp = round(float(temp),2)
-                # convert to bytes
-                temp = bytes(str(f"{temp} C\n"),"utf-8")
-                
-                # get car's speed
-                speed = round(float(get_speed(CAR_POWER_ACT)),2)
-                speed = bytes(str(f"{speed}\n"),"utf-8")
-                
-                # get car's power supply reading
-                power_supply = round(float(fc.power_read()),2)
-                power_supply = bytes(str(f"{power_supply}V\n"),"utf-8")
-                
-                # data to echo back to client
-                data_ret = temp + speed + power_supply
-                client.sendall(data_ret) # Echo back to client
-    except: 
+        data = await reader.read(1024)      # receive 1024 Bytes of message in binary format
+        # the preface can arrive split across segments, keep reading while what
+        # we have could still be the start of it
+        while data and len(data) < len(MAGIC) and MAGIC.startswith(data):
+            more = await reader.read(1024)
+            if more == b"":
+                break
+            data += more
+        if data.startswith(MAGIC):
+            await handle_persistent(reader, writer, data[len(MAGIC):])
+        elif data != b"":
+            await handle_legacy(writer, data)
+    except OSError as e:
+        print(f"Connection from {clientInfo} failed: {e}")
+    finally:
+        writer.close()
+
+async def main(host=HOST, port=PORT):
+    telemetry.start()
+    server = await asyncio.start_server(handle_client, host, port, reuse_address=True)
+    broadcaster = asyncio.create_task(broadcast_telemetry())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        broadcaster.cancel()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except:
         print("Closing socket")
-        client.close()
-        s.close()    
+        fc.stop()